@@ -1,9 +1,37 @@
 import requests
 import csv
+import hashlib
+import io
 import arcpy
+import numpy
 import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from etl.SpatialEtl import SpatialEtl
 
+# orjson parses the geocoder responses faster, fall back to the standard json module when it is not installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# number of new geocode results to hold before committing them to the cache
+CACHE_COMMIT_SIZE = 100
+
+# how many addresses to geocode one at a time between progress updates
+PROGRESS_INTERVAL = 50
+
+# runs of whitespace collapsed when normalizing an address
+_WHITESPACE = re.compile(r'\s+')
+
+
 class GSheetsEtl(SpatialEtl):
     """
     GSheetsETL performs an extract, transform, and load process using a URL to a Google spreadsheet.
@@ -25,14 +53,57 @@ class GSheetsEtl(SpatialEtl):
         """
         super().__init__(config_dict)
 
+        # reuse a single session so the geocoder connections are kept alive between requests
+        # the geocoder requests are safe to repeat, so POST is retried along with GET
+        retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET", "POST"])
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        # the geocoder url parts are used for every address, so look them up once
+        self._geocoder_prefix_url = self.config_dict['geocoder_prefix_url']
+        self._geocoder_suffix_url = self.config_dict['geocoder_suffix_url']
+
+        # the project directory is used as a prefix for every file the etl reads and writes
+        self._proj_dir = self.config_dict['proj_dir']
+
+        # persistent cache of geocoded addresses so each address only goes to the geocoder once across runs
+        self._cache = sqlite3.connect(f"{self._proj_dir}geocode_cache.sqlite",
+                                      check_same_thread=False)
+        self._cache.execute("CREATE TABLE IF NOT EXISTS geo(addr TEXT PRIMARY KEY, x REAL, y REAL)")
+        self._cache_lock = threading.Lock()
+        self._cache_pending = 0
+
     def process(self):
         """
-        Calls the three functions (extract, transform, load) in order
-        :return:
+        Calls the three functions (extract, transform, load) in order.
+        The sheet rows are streamed straight into transform instead of being re-read from disk
+        :return failures: the addresses that could not be geocoded
         """
-        self.extract()
-        self.transform()
+        failures = self.transform(self.extract_stream())
         self.load()
+        return failures
+
+    def sheet_version(self):
+        """
+        Asks the Google sheet for its version without downloading it, using the ETag or Last-Modified header
+        :return: a hash of the sheet url and version, or None if the sheet does not report a version
+        """
+        logging.info("Checking the sheet version...")
+        try:
+            r = self._session.head(self.config_dict.get('remote_url'), allow_redirects=True, timeout=10)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logging.warning("Could not check the sheet version: %s", e)
+            return None
+
+        version = r.headers.get('ETag') or r.headers.get('Last-Modified')
+        if not version:
+            logging.info("The sheet does not report a version")
+            return None
+        return hashlib.sha1(f"{self.config_dict.get('remote_url')}{version}".encode("utf-8")).hexdigest()
 
     def extract(self):
         """
@@ -40,37 +111,218 @@ class GSheetsEtl(SpatialEtl):
         :return: null
         """
         logging.info("Calling extract function...")
-        r = requests.get(self.config_dict.get('remote_url'))
-        r.encoding = "utf-8"
-        data = r.text  # changed from .text to .content
-        with open(f"{self.config_dict.get('proj_dir')}addresses.csv", "w") as output_file:
-            output_file.write(data)
+        # stream the response straight to disk instead of holding the whole sheet in memory
+        with self._session.get(self.config_dict.get('remote_url'), stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with open(f"{self._proj_dir}addresses.csv", "wb") as output_file:
+                shutil.copyfileobj(r.raw, output_file, length=65536)
         logging.info("Extract data file complete.")
 
-    def transform(self):
+    def extract_stream(self):
+        """
+        Pulls the information from a Google sheets web form which contains address, yielding the rows as they are
+        downloaded. The sheet is still written to the addresses file as it streams so there is a copy to review
+        :return: a generator of the sheet rows as dictionaries
         """
-        Calls the API for the U.S. Census geocoder to return coordinates of the provided address.
+        logging.info("Calling extract_stream function...")
+        with self._session.get(self.config_dict.get('remote_url'), stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            sheet = io.TextIOWrapper(r.raw, encoding="utf-8", newline="")
+            with open(f"{self._proj_dir}addresses.csv", "w", encoding="utf-8",
+                      newline="") as output_file:
+                yield from csv.DictReader(self._tee(sheet, output_file), delimiter=',')
+        logging.info("Extract data stream complete.")
+
+    @staticmethod
+    def _tee(lines, output_file):
+        """
+        Writes each line to the output file as it is passed along
+        :param lines: the lines to pass along
+        :param output_file: the open file to copy the lines into
+        :return: a generator of the same lines
+        """
+        for line in lines:
+            output_file.write(line)
+            yield line
+
+    def transform(self, rows=None):
+        """
+        Calls the API for the U.S. Census batch geocoder to return coordinates of the provided addresses.
+        Addresses already in the geocode cache are not sent to the geocoder.
         A new address file is created for the X Y coordinates
-        :return: null
+        :param rows: the sheet rows from extract_stream, if not provided the addresses file from extract is read
+        :return failures: the addresses that could not be geocoded
         """
         logging.info("Calling transform function...")
-        transformed_file = open(f"{self.config_dict.get('proj_dir')}new_addresses.csv", "w")
-        transformed_file.write("X,Y,Type\n")
-        with open(f"{self.config_dict.get('proj_dir')}addresses.csv", "r") as partial_file:
-            csv_dict = csv.DictReader(partial_file, delimiter=',')
-            for row in csv_dict:
-                address = row["Street Address"] + " Boulder CO"
-                logging.info(f"{address}")
-                print("Please wait...")
-                geocode_url = f"{self.config_dict.get('geocoder_prefix_url')}{address}{self.config_dict.get('geocoder_suffix_url')}"
-                # print(geocode_url)
-                r = requests.get(geocode_url)
-                resp_dict = r.json()
-                x = resp_dict['result']['addressMatches'][0]['coordinates']['x']
-                y = resp_dict['result']['addressMatches'][0]['coordinates']['y']
-                transformed_file.write(f"{x},{y},Residential\n")
-        transformed_file.close()
+        if rows is None:
+            with open(f"{self._proj_dir}addresses.csv", "r", encoding="utf-8", newline="") as partial_file:
+                streets = [row["Street Address"] for row in csv.DictReader(partial_file, delimiter=',')]
+        else:
+            streets = [row["Street Address"] for row in rows]
+
+        # check the cache first, only the addresses that are not cached are sent to the geocoder
+        keys = [self.normalize_address(f"{street} Boulder CO") for street in streets]
+        coordinates = self._get_cached(keys)
+        # the same household can submit the form more than once, so each address is only geocoded once per run
+        missing = list({key: street for key, street in zip(keys, streets) if key not in coordinates}.items())
+        logging.info("%s addresses found in the geocode cache, %s unique addresses to geocode",
+                     len(coordinates), len(missing))
+
+        # split the remaining addresses into batches the batch geocoder accepts, and send the batches in parallel
+        logging.info("Geocoding %s addresses...", len(missing))
+        batch_size = self.config_dict.get('geocode_batch_size', 10000)
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        with ThreadPoolExecutor(max_workers=self.config_dict.get('geocode_batch_workers', 4)) as executor:
+            for i, batch_result in enumerate(executor.map(self._geocode_batch, batches), 1):
+                coordinates.update(batch_result)
+                logging.info("Geocoded batch %s of %s", i, len(batches))
+
+        # commit whatever is left over from the last batch of cache writes
+        with self._cache_lock:
+            self._cache.commit()
+            self._cache_pending = 0
+
+        # keep a list of the addresses that could not be geocoded for review instead of stopping the etl
+        failures = [street for key, street in missing if key not in coordinates]
+        with open(f"{self._proj_dir}failures.csv", "w", newline="") as failures_file:
+            writer = csv.writer(failures_file)
+            writer.writerow(("Street Address",))
+            writer.writerows((street,) for street in failures)
+        if failures:
+            logging.warning("%s addresses could not be geocoded, see failures.csv", len(failures))
+
+        # write the coordinates in the same order as the address file
+        with open(f"{self._proj_dir}new_addresses.csv", "w", newline="",
+                  buffering=1 << 20) as transformed_file:
+            writer = csv.writer(transformed_file)
+            writer.writerow(("X", "Y", "Type"))
+            # skip the addresses the geocoder could not match
+            writer.writerows((*coordinates[key], "Residential") for key in keys if key in coordinates)
         logging.info("Transform data file complete.")
+        return failures
+
+    def _get_cached(self, keys):
+        """
+        Looks up previously geocoded addresses in the geocode cache
+        :param keys: the normalized addresses to look up
+        :return: a dictionary of the normalized address to a tuple of the X Y coordinates for the cached addresses
+        """
+        cached = {}
+        with self._cache_lock:
+            for key in set(keys):
+                row = self._cache.execute("SELECT x, y FROM geo WHERE addr=?", (key,)).fetchone()
+                if row:
+                    cached[key] = row
+        return cached
+
+    def _cache_result(self, key, x, y):
+        """
+        Stores a geocoded address in the geocode cache, committing every CACHE_COMMIT_SIZE results
+        :param key: the normalized address
+        :param x: the X coordinate of the address
+        :param y: the Y coordinate of the address
+        :return: null
+        """
+        with self._cache_lock:
+            self._cache.execute("INSERT OR REPLACE INTO geo(addr, x, y) VALUES (?, ?, ?)", (key, x, y))
+            self._cache_pending += 1
+            if self._cache_pending >= CACHE_COMMIT_SIZE:
+                self._cache.commit()
+                self._cache_pending = 0
+
+    def _geocode_batch(self, batch):
+        """
+        Calls the U.S. Census batch geocoder with a batch of addresses in a single request.
+        If the batch request fails, the addresses are geocoded one at a time instead
+        :param batch: a list of (normalized address, street address) tuples
+        :return: a dictionary of the normalized address to a tuple of the X Y coordinates for the matched addresses
+        """
+        # build the csv the batch geocoder expects: Unique ID, Street address, City, State, ZIP
+        address_file = io.StringIO()
+        writer = csv.writer(address_file)
+        for i, (key, street) in enumerate(batch):
+            writer.writerow((i, street, "Boulder", "CO", ""))
+
+        try:
+            r = self._session.post(self.config_dict.get('geocoder_batch_url'),
+                                   data={'benchmark': self.config_dict.get('geocoder_benchmark', 'Public_AR_Current')},
+                                   files={'addressFile': ('addresses.csv', address_file.getvalue(), 'text/csv')},
+                                   timeout=600)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logging.warning("Batch geocode failed, geocoding %s addresses one at a time: %s", len(batch), e)
+            return self._geocode_each(batch)
+
+        # each result line is: ID, input address, match status, match type, matched address, "X,Y", ...
+        results = {}
+        for line in csv.reader(io.StringIO(r.text)):
+            if len(line) < 6 or line[2] != "Match":
+                continue
+            key, street = batch[int(line[0])]
+            x, y = (float(value) for value in line[5].split(","))
+            self._cache_result(key, x, y)
+            results[key] = (x, y)
+
+        logging.info("Batch geocoder matched %s of %s addresses", len(results), len(batch))
+        return results
+
+    def _geocode_each(self, batch):
+        """
+        Calls the U.S. Census one line geocoder for each address of a batch, in parallel
+        :param batch: a list of (normalized address, street address) tuples
+        :return: a dictionary of the normalized address to a tuple of the X Y coordinates for the matched addresses
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.config_dict.get('geocode_workers', 16)) as executor:
+            matches = executor.map(self._geocode_one, batch)
+            for i, ((key, street), match) in enumerate(zip(batch, matches), 1):
+                if match is not None:
+                    results[key] = match
+                # only report progress every so often so the workers are not waiting on the log
+                if i % PROGRESS_INTERVAL == 0:
+                    logging.info("Geocoded %s of %s addresses...", i, len(batch))
+        return results
+
+    def _geocode_one(self, item):
+        """
+        Calls the API for the U.S. Census geocoder for a single address
+        :param item: a (normalized address, street address) tuple
+        :return: a tuple of the X Y coordinates, or None if the address could not be matched
+        """
+        key, street = item
+        address = street + " Boulder CO"
+        logging.info("%s", address)
+        # encode the address so its spaces and punctuation reach the geocoder as part of the address parameter
+        geocode_url = f"{self._geocoder_prefix_url}{quote_plus(address)}{self._geocoder_suffix_url}"
+        try:
+            r = self._session.get(geocode_url, timeout=10)
+            r.raise_for_status()
+            resp_dict = json_loads(r.content)
+        except (requests.RequestException, ValueError) as e:
+            logging.warning("Geocode request failed for address: %s: %s", address, e)
+            return None
+
+        try:
+            coordinates = resp_dict['result']['addressMatches'][0]['coordinates']
+        except (KeyError, IndexError):
+            logging.warning("No match found for address: %s", address)
+            return None
+
+        x = coordinates['x']
+        y = coordinates['y']
+        self._cache_result(key, x, y)
+        return x, y
+
+    @staticmethod
+    def normalize_address(address):
+        """
+        Normalizes an address so the same address entered differently uses the same cache key
+        :param address: the address to normalize
+        :return: the address in upper case with the whitespace collapsed
+        """
+        return _WHITESPACE.sub(' ', address.strip().upper())
 
     def load(self):
         """
@@ -79,22 +331,40 @@ class GSheetsEtl(SpatialEtl):
         """
 
         logging.info("Calling load function...")
-        # set environment settings
-        arcpy.env.workspace = f"{self.config_dict.get('arcpy_gdb')}"
-        arcpy.env.overwriteOutput = True
-
-        # set the local variables
-        in_table = f"{self.config_dict.get('proj_dir')}new_addresses.csv"
-        out_feature_class = self.config_dict.get('avoid_points')
-        x_coords = "X"
-        y_coords = "Y"
-
-        # make the XY event layer
-        arcpy.management.XYTableToPoint(in_table=in_table,
-                                        out_feature_class=out_feature_class,
-                                        x_field=x_coords,
-                                        y_field=y_coords)
-
-        # print the total rows
-        print(f"Total rows for feature class: {arcpy.GetCount_management(out_feature_class)}")
-        logging.info(f"Total rows for feature class: {arcpy.GetCount_management(out_feature_class)}")
\ No newline at end of file
+        # set environment settings only for the load, the analysis in the main program keeps its own workspace and
+        # overwrite setting
+        with arcpy.EnvManager(workspace=f"{self.config_dict.get('arcpy_gdb')}", overwriteOutput=True):
+            # set the local variables
+            in_table = f"{self._proj_dir}new_addresses.csv"
+            out_feature_class = os.path.join(f"{self.config_dict.get('arcpy_gdb')}",
+                                             self.config_dict.get('avoid_points'))
+            x_coords = "X"
+            y_coords = "Y"
+
+            # read the geocoded addresses straight into an array instead of having a geoprocessing tool re-parse the
+            # csv
+            points = numpy.genfromtxt(in_table, delimiter=",", names=True, encoding="utf-8", ndmin=1,
+                                      dtype=[(x_coords, "f8"), (y_coords, "f8"), ("Type", "U16")])
+
+            # keep the existing feature class when no address was geocoded, there is nothing to replace it with
+            if points.size == 0:
+                logging.warning("No geocoded addresses in %s, keeping the existing %s", in_table, out_feature_class)
+                return
+
+            # replace the existing feature class, NumPyArrayToFeatureClass will not overwrite it. The delete fails
+            # when there is nothing to replace, which saves a separate existence check
+            try:
+                arcpy.management.Delete(out_feature_class)
+            except arcpy.ExecuteError:
+                logging.debug("%s does not exist yet", out_feature_class)
+
+            # create the point feature class, the geocoder returns WGS 1984 coordinates
+            arcpy.da.NumPyArrayToFeatureClass(in_array=points,
+                                              out_table=out_feature_class,
+                                              shape_fields=(x_coords, y_coords),
+                                              spatial_reference=arcpy.SpatialReference(4326))
+
+            # print the total rows
+            count = int(arcpy.management.GetCount(out_feature_class).getOutput(0))
+            print(f"Total rows for feature class: {count}")
+            logging.info("Total rows for feature class: %s", count)
\ No newline at end of file
@@ -22,18 +22,19 @@ class SpatialEtl:
         Extracts data from the remote url to the project directory, both found within config_dict
         :return: null
         """
-        logging.info(f"Extracting data from {self.config_dict.get('remote_url')} to {self.config_dict.get('proj_dir')}")
+        logging.info("Extracting data from %s to %s",
+                     self.config_dict.get('remote_url'), self.config_dict.get('proj_dir'))
 
     def transform(self):
         """
         Transforms the data using the data format from config_dict
         :return: null
         """
-        logging.info(f"Transforming {self.config_dict.get('data_format')}")
+        logging.info("Transforming %s", self.config_dict.get('data_format'))
 
     def load(self):
         """
         Loads the data into the destination from config_dict
         :return: null
         """
-        logging.info(f"Loading data into {self.config_dict.get('destination')}")
\ No newline at end of file
+        logging.info("Loading data into %s", self.config_dict.get('destination'))
\ No newline at end of file
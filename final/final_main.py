@@ -1,45 +1,234 @@
+import argparse
+import atexit
 import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 
 import arcpy
-import re
-import yaml
 import arcgisscripting
-from etl.GSheetsEtl import GSheetsEtl
 
-def etl():
+# path to the ArcGIS project file, set in setup
+APRX_PATH = None
+# the open ArcGIS project with its first map and layout, see get_project
+_APRX_CACHE = {}
+
+# fill and outline colors of the source layers in the exported map
+_SYMBOLOGY = {
+    "Lakes_and_Reservoirs": ({'RGB': [115, 223, 255, 100]}, {'RGB': [0, 112, 255, 100]}),
+    "Wetlands": ({'RGB': [211, 255, 190, 100]}, {'RGB': [110, 110, 110, 100]}),
+    "Mosquito_Larval_Sites": ({'RGB': [255, 255, 115, 100]}, {'RGB': [0, 0, 0, 100]}),
+    "OSMP_Properties": ({'RGB': [56, 168, 0, 100]}, {'RGB': [110, 110, 110, 100]}),
+}
+# fill and outline colors of the targeted area and address layers, which are named by the user
+_TARGET_SYMBOLOGY = ({'RGB': [255, 0, 0, 50]}, {'RGB': [0, 0, 0, 50]})
+_ADDRESS_SYMBOLOGY = ({'RGB': [156, 156, 156, 100]}, {'RGB': [0, 0, 0, 100]})
+
+# layers that exist in gdb which will be buffered, and the addresses they are joined with
+LAYERS_TO_BUFFER = ("Lakes_and_Reservoirs", "Wetlands", "Mosquito_Larval_Sites", "OSMP_Properties")
+ADDRESS_LAYER = "Boulder_Addresses"
+
+# lower case names of the layers in the geodatabase, see delete_existing_layer
+_EXISTING_LAYERS = set()
+# intermediate layers that were written to the memory workspace instead of the geodatabase, see gdb_path
+_MEMORY_LAYERS = set()
+# answers given to the prompts on the last run, keyed by prompt, they are reused unless --interactive is passed
+_SESSION = {}
+SESSION_PATH = None
+# menu options from the config, bound once in setup so the prompts do not look them up each time
+VALID_UNITS = ()
+DEFAULT_UNIT = None
+VALID_YN = ()
+# numbered menus for the selection prompts and what can be typed at them, see menu_choices
+UNIT_MENU = ""
+YN_MENU = ""
+UNIT_CHOICES = {}
+YN_CHOICES = {}
+# command line options, see parse_args
+ARGS = argparse.Namespace(buffer_dist=None, buffer_unit=None, yes=False, interactive=False)
+
+# a layer name starts with a letter or underscore, followed by up to 159 letters, numbers or underscores
+_VALID_LAYER_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]{0,159}')
+# a plain decimal number, checked before converting the input in get_number
+_NUM_RE = re.compile(r'-?(?:\d+(?:\.\d*)?|\.\d+)')
+
+def parse_args(argv: list[str]=None):
     """
-    Start the ETL process which gets the addresses to opt out
-    :return: null
+    Reads the command line options, any option that is not given is asked for when it is needed
+    :param argv: the command line arguments, default is the arguments the script was run with
+    :return: the parsed options
     """
-    print("Starting ETL process... Please wait")
+
+    parser = argparse.ArgumentParser(description="West Nile Virus outbreak analysis")
+    parser.add_argument('--buffer-dist', type=float,
+                        help="distance to buffer every layer by instead of asking for each layer")
+    parser.add_argument('--buffer-unit', type=str.capitalize,
+                        help="unit of the buffer distance, one of the valid_units in the config")
+    parser.add_argument('--yes', action='store_true',
+                        help="answer yes to every yes or no question")
+    parser.add_argument('--interactive', action='store_true',
+                        help="ask every question again instead of reusing the answers from the last run")
+    return parser.parse_args(argv)
+
+
+def etl_extract():
+    """
+    Runs the network part of the ETL which gets the addresses to opt out: checks the sheet version, then downloads and
+    geocodes the sheet unless it has not changed since the avoid points were last loaded. It does not use arcpy or
+    print, so it can run in a background thread while the user answers the prompts
+    :return etl_state: the etl instance, the sheet version, and the addresses that could not be geocoded or None when
+    the sheet was not transformed, or None on error
+    """
+    logging.info("Starting ETL process...")
     try:
-        logging.info("Starting ETL process...")
+        # the etl pulls in requests and numpy, so it is only imported when the etl runs
+        from etl.GSheetsEtl import GSheetsEtl
         etl_instance = GSheetsEtl(config_dict)
-        etl_instance.process()
+
+        # skip the download when the sheet has not changed since the avoid points were last loaded, etl_load checks
+        # the avoid points still exist
+        cache_path = config_dict.get('etl_cache', 'config/etl_cache.json')
+        cache_key = etl_instance.sheet_version()
+        etl_cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                etl_cache = json.load(f)
+        if cache_key and etl_cache.get(cache_key) == gdb_path(config_dict.get('avoid_points')):
+            logging.info("Sheet unchanged since the avoid points were last loaded")
+            return etl_instance, cache_key, None
+
+        failures = etl_instance.transform(etl_instance.extract_stream())
+        return etl_instance, cache_key, failures
+
+    except Exception as e:
+        logging.error("Error encountered in etl_extract: %s", e)
+
+
+def etl_load(etl_state):
+    """
+    Runs the arcpy part of the ETL on the main thread: loads the geocoded addresses into the avoid points layer and
+    remembers the sheet version they were loaded from
+    :param etl_state: the result of etl_extract
+    :return: null
+    """
+    print("Loading the addresses to opt out... Please wait")
+    try:
+        if etl_state is None:
+            print("Error encountered in etl: the opt-out sheet could not be processed, see the log")
+            return
+        etl_instance, cache_key, failures = etl_state
+
+        # reuse the existing avoid points when the sheet has not changed
+        avoid_points = gdb_path(config_dict.get('avoid_points'))
+        if failures is None:
+            if arcpy.Exists(avoid_points):
+                print("The opt-out sheet has not changed, reusing the existing avoid points")
+                logging.info("Sheet unchanged, reusing '%s'", avoid_points)
+                return
+            # the avoid points were removed since the last run, so the sheet is processed again
+            failures = etl_instance.transform(etl_instance.extract_stream())
+
+        etl_instance.load()
+
+        # remember which sheet version the avoid points were loaded from, only when every address was geocoded so
+        # the failed addresses are retried on the next run
+        if cache_key and not failures:
+            cache_path = config_dict.get('etl_cache', 'config/etl_cache.json')
+            with open(cache_path, "w") as f:
+                json.dump({cache_key: avoid_points}, f)
 
     except Exception as e:
         print(f"Error encountered in etl: {e}")
 
 
+def menu_choices(options: list[str]) -> dict:
+    """
+    Builds the lookup of what can be typed at a numbered menu: the number of an option, its name, or its first letter
+    when no other option starts with the same letter. All keys are lower case
+    :param options: the options in the menu, in menu order
+    :return choices: the typed text mapped to the option it selects
+    """
+
+    first_letters = [option[0].lower() for option in options]
+    choices = {}
+    for i, option in enumerate(options, 1):
+        choices[str(i)] = option
+        choices[option.lower()] = option
+        if first_letters.count(option[0].lower()) == 1:
+            choices[option[0].lower()] = option
+    return choices
+
+
+def load_config(yaml_path: str) -> dict:
+    """
+    Loads the yaml config file. The parsed config is saved as a json file next to it, which is loaded instead while it
+    is newer than the yaml file since json is much faster to parse
+    :param yaml_path: the path to the yaml config file
+    :return config_dict: the config dictionary
+    """
+
+    json_path = os.path.splitext(yaml_path)[0] + '.json'
+
+    # use the json copy when the yaml file has not changed since it was written
+    try:
+        if os.path.getmtime(json_path) >= os.path.getmtime(yaml_path):
+            with open(json_path) as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        # no usable json copy, logging is not set up yet so fall back to the yaml file quietly
+        pass
+
+    # parse the yaml file and save the json copy for the next run, yaml is only imported when the json copy is stale
+    import yaml
+    # use the libyaml C loader when it is available
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+    with open(yaml_path) as f:
+        config_dict = yaml.load(f, Loader=SafeLoader)
+    try:
+        with open(json_path, 'w') as f:
+            json.dump(config_dict, f)
+    except OSError:
+        # the json copy is only a speed up, the yaml file is parsed again next run
+        pass
+    return config_dict
+
+
 def setup():
     """
     Sets up the work space for Arcpy to use
     :return: null
     """
+    global APRX_PATH, SESSION_PATH, VALID_UNITS, DEFAULT_UNIT, VALID_YN, UNIT_MENU, YN_MENU, UNIT_CHOICES, YN_CHOICES
 
     # inform the user and log
     print("Setting up workspace")
     try:
-        # open the yaml config file and fill in the config_dict
-        with open('config/wnvoutbreak.yaml') as f:
-            config_dict = yaml.load(f, Loader=yaml.FullLoader)
-
-        # set up log location and level
+        # fill in the config_dict from the yaml config file
+        config_dict = load_config('config/wnvoutbreak.yaml')
+
+        # set up log location and level, the log file is written by a background thread so logging does not wait on disk
+        log_queue = queue.Queue(-1)
+        file_handler = logging.FileHandler(f"{config_dict.get('log_dir')}wnv.log", mode="w")
+        # the records are written to the file in batches, warnings and errors are written straight away
+        buffered_handler = logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING,
+                                                          target=file_handler)
+        listener = logging.handlers.QueueListener(log_queue, buffered_handler)
+        listener.start()
+        # at exit stop the listener first, then write out what is left in the buffer
+        atexit.register(buffered_handler.close)
+        atexit.register(listener.stop)
         logging.basicConfig(level=logging.DEBUG,
-                            filename=f"{config_dict.get('log_dir')}wnv.log",
-                            filemode="w" )
+                            handlers=[logging.handlers.QueueHandler(log_queue)])
 
         logging.debug("Setting up workspace")
 
@@ -47,10 +236,66 @@ def setup():
         print("CAUTION: all layers that are generated in this script may be overwritten or removed.")
         logging.warning("CAUTION: all layers that are generated in this script may be overwritten or removed.")
 
+        # menu options for the selection prompts
+        VALID_UNITS = tuple(config_dict['valid_units'])
+        DEFAULT_UNIT = config_dict['default_unit']
+        VALID_YN = tuple(config_dict['valid_answers_y_n'])
+
+        # numbered menus for the selection prompts, built once instead of on every prompt
+        UNIT_MENU = '\n'.join(f"{i}. {unit}" for i, unit in enumerate(VALID_UNITS, 1))
+        YN_MENU = '\n'.join(f"{i}. {answer}" for i, answer in enumerate(VALID_YN, 1))
+        # what can be typed at those menus, see menu_choices
+        UNIT_CHOICES = menu_choices(VALID_UNITS)
+        YN_CHOICES = menu_choices(VALID_YN)
+
+        # load the answers from the last run, see get_session_answer
+        SESSION_PATH = config_dict.get('session_file', 'config/session.json')
+        if os.path.exists(SESSION_PATH):
+            with open(SESSION_PATH) as f:
+                _SESSION.update(json.load(f))
+
+        # geodatabase path prefix that layer names are appended to, see gdb_path
+        config_dict['gdb_prefix'] = config_dict['arcpy_gdb'].rstrip('\\/') + os.sep
+        # ArcGIS project file, see get_project
+        APRX_PATH = os.path.join(config_dict['arcpy_workspace'], "WestNileOutbreak.aprx")
+
         # Geodatabase workplace location
         arcpy.env.workspace = f"{config_dict.get('arcpy_workspace')}"
         # allow for overwriting
-        arcpy.env.overwriteOutput = f"{config_dict.get('arcpy_overwrite')}"
+        arcpy.env.overwriteOutput = bool(config_dict.get('arcpy_overwrite'))
+        # let the geoprocessing tools that support it use multiple cores
+        arcpy.env.parallelProcessingFactor = config_dict.get('parallel_factor', '100%')
+        # only change the xy tolerance when one is configured
+        if config_dict.get('xy_tolerance'):
+            arcpy.env.XYTolerance = config_dict.get('xy_tolerance')
+
+        with arcpy.EnvManager(workspace=config_dict['arcpy_gdb']):
+            feature_classes = arcpy.ListFeatureClasses() or []
+
+            # make sure the analysis inputs have a spatial index so the overlay and location tools do not scan every
+            # feature, the indexed layers are remembered so the analysis functions do not add them again. Only the
+            # inputs are checked, the outputs of earlier runs left in the geodatabase are not
+            config_dict['_indexed'] = set()
+            analysis_inputs = {name.lower() for name in LAYERS_TO_BUFFER + (ADDRESS_LAYER,)}
+            for fc in feature_classes:
+                if fc.lower() not in analysis_inputs:
+                    continue
+                if not arcpy.Describe(fc).hasSpatialIndex:
+                    logging.debug("Adding a spatial index to '%s'", fc)
+                    # the index only speeds up the analysis, so a layer that cannot be indexed, for example because
+                    # it is locked, is skipped instead of stopping the setup. It is still marked as done so the
+                    # analysis functions do not try again
+                    try:
+                        arcpy.management.AddSpatialIndex(fc)
+                    except arcgisscripting.ExecuteError as e:
+                        logging.warning("Could not add a spatial index to '%s': %s", fc, e)
+                config_dict['_indexed'].add(fc.lower())
+
+            # when layers are not overwritten, list the geodatabase once so each delete does not need its own catalog
+            # probe
+            if not arcpy.env.overwriteOutput:
+                for name in feature_classes + (arcpy.ListTables() or []):
+                    _EXISTING_LAYERS.add(name.lower())
 
         logging.debug("Setup complete")
         return config_dict
@@ -58,6 +303,18 @@ def setup():
         print(f"Error encountered in setup: {e}")
 
 
+def gdb_path(layer_name: str) -> str:
+    """
+    Builds the full geodatabase path of a layer from the prefix computed once in setup. Intermediate layers that were
+    not persisted are found in the memory workspace instead
+    :param layer_name: the layer name in the geodatabase
+    :return: the full path to the layer
+    """
+    if layer_name in _MEMORY_LAYERS:
+        return f"memory\\{layer_name}"
+    return config_dict['gdb_prefix'] + layer_name
+
+
 def set_spatial_reference():
     """
     Sets the spatial reference of the map
@@ -66,237 +323,344 @@ def set_spatial_reference():
 
     logging.debug("Setting spatial reference")
     try:
-        # get the project path
-        proj_path = f"{config_dict.get('arcpy_workspace')}"
-
-        # get the project
-        aprx = arcpy.mp.ArcGISProject(rf"{proj_path}\WestNileOutbreak.aprx")
-
-        # get the map
-        map_doc = aprx.listMaps()[0]
+        # get the project map
+        aprx, map_doc, layout = get_project()
 
         # set the state plane to NAD 1983 state plane co north (feet)
         # https://spatialreference.org/ref/esri/102653/
         co_north = arcpy.SpatialReference(102653)
         map_doc.spatialReference = co_north
 
-        logging.info(f"Spatial reference changed to {co_north.name}")
+        logging.info("Spatial reference changed to %s", co_north.name)
 
     except RuntimeError as e:
-        logging.error(f"Spatial error encountered: {e}")
+        logging.error("Spatial error encountered: %s", e)
     except Exception as e:
         print(f"Error encountered in set_spatial_reference: {e}")
 
 
-def buffer(layer_name: str):
+def get_buffer_distance(layer_name: str):
     """
-    Buffer the incoming layer by a selected buffer distance
-    assumes the layer is preloaded in the ArcGIS project
+    Prompts the user for the buffer distance and unit to use for the incoming layer
     :param layer_name: the layer name that will be buffered
-    :return output_buffer_layer_name: the layer name that was created for the buffer analysis
+    :return output_buffer_layer_name, buff_dist: the layer name to create and the distance with units to buffer by
     """
 
-    logging.debug("Starting buffer")
+    logging.debug("Entering get_buffer_distance")
 
-    try:
-        # create buffer layer name
-        output_buffer_layer_name = f"buff_{layer_name}"
+    # create buffer layer name
+    output_buffer_layer_name = f"buff_{layer_name}"
+
+    # buffer settings preset in the parameters block of the config
+    preset = get_parameter('buffers', layer_name) or {}
 
-        # get distance from user
+    # get distance from the command line, the config, or from the user
+    if ARGS.buffer_dist is not None:
+        buff_num = ARGS.buffer_dist
+    elif preset.get('distance') is not None:
+        buff_num = float(preset['distance'])
+    else:
         prompt = f"Enter a distance for layer '{output_buffer_layer_name}' "
         buff_num = get_number(prompt=prompt, num_type=float, default=1000)
-        print(f"You selected: {buff_num}")
+    print(f"You selected: {buff_num}")
 
-        # get unit from user
-        unit = get_units_for_buffer()
-        print(f"You selected: {unit}")
+    # get unit from the command line, the config, or from the user
+    if ARGS.buffer_unit in VALID_UNITS:
+        unit = ARGS.buffer_unit
+    elif preset.get('unit') in VALID_UNITS:
+        unit = preset['unit']
+    else:
+        unit = get_units_for_buffer(session_key=f"Select a unit for layer '{output_buffer_layer_name}'")
+    print(f"You selected: {unit}")
 
-        # combine the distance and units as a string for buffer analysis
-        buff_dist = str(buff_num) + " " + unit
+    # combine the distance and units as a string for buffer analysis
+    buff_dist = str(buff_num) + " " + unit
 
-        # check if the layer exists, delete it if it does
-        delete_existing_layer(output_buffer_layer_name)
+    logging.debug("Exiting get_buffer_distance")
+    return output_buffer_layer_name, buff_dist
+
+
+def run_buffer(config: dict, layer_name: str, output_buffer_layer_name: str, buff_dist: str, out_gdb: str=None):
+    """
+    Runs the buffer analysis without any prompts so it can also be run in a worker process
+    :param config: the config dictionary, passed in since worker processes do not share the module globals
+    :param layer_name: the layer name that will be buffered
+    :param output_buffer_layer_name: the layer name that will be created for the buffer analysis
+    :param buff_dist: the distance and units to buffer by
+    :param out_gdb: the geodatabase to write the buffer to, otherwise it is written to the memory workspace of this
+    process, so only the main process can leave it out
+    :return output_buffer_layer_name: the layer name that was created for the buffer analysis
+    """
+
+    # worker processes start with a fresh arcpy environment
+    arcpy.env.workspace = f"{config.get('arcpy_workspace')}"
+    arcpy.env.overwriteOutput = bool(config.get('arcpy_overwrite'))
+    arcpy.env.parallelProcessingFactor = config.get('parallel_factor', '100%')
+    if config.get('xy_tolerance'):
+        arcpy.env.XYTolerance = config.get('xy_tolerance')
+
+    # set up the project layer path
+    in_features = config['gdb_prefix'] + layer_name
+    if out_gdb:
+        out_features = os.path.join(out_gdb, output_buffer_layer_name)
+    else:
+        out_features = f"memory\\{output_buffer_layer_name}"
+
+    # call the pairwise buffer analysis, it always buffers both sides with round ends and runs on multiple cores
+    arcpy.analysis.PairwiseBuffer(in_features=in_features,
+                                  out_feature_class=out_features,
+                                  buffer_distance_or_field=buff_dist,
+                                  dissolve_option="ALL")
+
+    return output_buffer_layer_name
+
+
+def run_scratch_buffer(config: dict, layer_name: str, output_buffer_layer_name: str, buff_dist: str):
+    """
+    Runs the buffer analysis in a worker process into a new file geodatabase of its own, since a file geodatabase
+    cannot safely be written to by several processes at once. The main process copies the result back
+    :param config: the config dictionary, passed in since worker processes do not share the module globals
+    :param layer_name: the layer name that will be buffered
+    :param output_buffer_layer_name: the layer name that will be created for the buffer analysis
+    :param buff_dist: the distance and units to buffer by
+    :return scratch_features: the full path to the buffer in the scratch geodatabase
+    """
+
+    # every call gets its own folder, so workers never share a geodatabase
+    scratch_dir = tempfile.mkdtemp(prefix="buffer_")
+    scratch_gdb = arcpy.management.CreateFileGDB(scratch_dir, "scratch.gdb")[0]
+    run_buffer(config, layer_name, output_buffer_layer_name, buff_dist, out_gdb=scratch_gdb)
+    return os.path.join(scratch_gdb, output_buffer_layer_name)
+
+
+def buffer(layer_name: str, buffer_spec: tuple[str, str]=None):
+    """
+    Buffer the incoming layer by a selected buffer distance, the buffer is only used by later analysis so it is
+    written to the memory workspace
+    assumes the layer is preloaded in the ArcGIS project
+    :param layer_name: the layer name that will be buffered
+    :param buffer_spec: the output layer name and distance from get_buffer_distance, asked for when not provided
+    :return output_buffer_layer_name: the layer name that was created for the buffer analysis
+    """
+
+    logging.debug("Starting buffer")
+
+    try:
+        # get the distance and unit from the user, unless they were planned already
+        output_buffer_layer_name, buff_dist = buffer_spec or get_buffer_distance(layer_name)
 
         # perform the buffer analysis
-        logging.info(f"Buffering '{layer_name}' to generate '{output_buffer_layer_name}' at {buff_dist}")
-
-        # set up the project layer path
-        in_features = os.path.join(f"{config_dict.get('arcpy_gdb')}", layer_name)
-        logging.debug(f"Buffer in_features: {in_features}")
-        out_features = os.path.join(f"{config_dict.get('arcpy_gdb')}", output_buffer_layer_name)
-        logging.debug(f"Buffer out_features: {out_features}")
-
-        # call buffer analysis
-        arcpy.analysis.Buffer(in_features=in_features,
-                              out_feature_class=out_features,
-                              buffer_distance_or_field=buff_dist,
-                              line_side="FULL",
-                              line_end_type="ROUND",
-                              dissolve_option="ALL")
-
-        logging.info(f"Buffer '{output_buffer_layer_name}' complete")
+        logging.info("Buffering '%s' to generate '%s' at %s", layer_name, output_buffer_layer_name, buff_dist)
+        run_buffer(config_dict, layer_name, output_buffer_layer_name, buff_dist)
+        _MEMORY_LAYERS.add(output_buffer_layer_name)
+
+        logging.info("Buffer '%s' complete", output_buffer_layer_name)
         return output_buffer_layer_name
 
     except Exception as e:
         print(f"Error encountered in buffer: {e}")
 
 
-def intersect(buffer_list: list[str], default_layer_name: str="intersect_layer"):
+def buffer_layers(layer_names: list[str], buffer_specs: list[tuple[str, str]]=None):
     """
-    Uses the intersect analysis on the incoming layers
-    :param buffer_list: a list of layer names that will be used for the intersect
-    :return intersect_layer: the layer name generated for the intersect analysis
+    Buffer the incoming layers in parallel. The distances are asked for up front, then each buffer analysis
+    runs in its own process since the layers do not depend on each other
+    :param layer_names: the layer names that will be buffered
+    :param buffer_specs: the output layer name and distance from get_buffer_distance for each layer, asked for when
+    not provided
+    :return buffer_layer_list: the layer names that were created for the buffer analysis, in the same order
     """
 
-    logging.info(f"Starting the intersect analysis")
+    logging.debug("Starting buffer_layers")
+
     try:
-        # get buffer name from user
-        intersect_layer = get_valid_layer_name(default_layer_name)
+        # get all the distances from the user before running any analysis, unless they were planned already
+        if buffer_specs is None:
+            buffer_specs = [get_buffer_distance(layer_name) for layer_name in layer_names]
+
+        output_names = []
+        buff_dists = []
+        for layer_name, (output_buffer_layer_name, buff_dist) in zip(layer_names, buffer_specs):
+            delete_existing_layer(output_buffer_layer_name)
+            output_names.append(output_buffer_layer_name)
+            buff_dists.append(buff_dist)
+            logging.info("Buffering '%s' to generate '%s' at %s", layer_name, output_buffer_layer_name, buff_dist)
+
+        # arcpy is not thread safe, so run the buffers in separate processes, each writing to its own scratch
+        # geodatabase
+        print("Buffering layers... Please wait")
+        max_workers = min(4, os.cpu_count() or 1)
+        # the buffers already run side by side, so each one only gets its share of the cores instead of all of them
+        worker_config = {**config_dict, 'parallel_factor': f"{100 // max_workers}%"}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            scratch_features = list(executor.map(run_scratch_buffer,
+                                                 [worker_config] * len(layer_names),
+                                                 layer_names,
+                                                 output_names,
+                                                 buff_dists))
+
+        # the workers have exited and released their locks, so copy the buffers into the project geodatabase one at a
+        # time and remove the scratch geodatabases
+        buffer_layer_list = []
+        try:
+            for output_buffer_layer_name, scratch_feature in zip(output_names, scratch_features):
+                logging.debug("Copying '%s' to '%s'", scratch_feature, gdb_path(output_buffer_layer_name))
+                arcpy.management.CopyFeatures(scratch_feature, gdb_path(output_buffer_layer_name))
+                _EXISTING_LAYERS.add(output_buffer_layer_name.lower())
+                buffer_layer_list.append(output_buffer_layer_name)
+        finally:
+            for scratch_feature in scratch_features:
+                shutil.rmtree(os.path.dirname(os.path.dirname(scratch_feature)), ignore_errors=True)
+
+        logging.info("Buffers %s complete", buffer_layer_list)
+        return buffer_layer_list
 
-        # check if the layer exists, delete it if it does
-        delete_existing_layer(intersect_layer)
+    except Exception as e:
+        print(f"Error encountered in buffer_layers: {e}")
+
+
+def intersect(buffer_list: list[str], layer_name: str="intersect_layer"):
+    """
+    Uses the intersect analysis on the incoming layers, the intersect is only used by later analysis so it is written
+    to the memory workspace
+    :param buffer_list: a list of layer names that will be used for the intersect
+    :param layer_name: the name of the layer to create in the memory workspace
+    :return layer_name: the layer name generated for the intersect analysis
+    """
 
+    logging.info("Starting the intersect analysis")
+    try:
         # perform the intersect analysis
-        logging.info(f"Using {buffer_list} to create '{intersect_layer}'")
+        logging.info("Using %s to create '%s'", buffer_list, layer_name)
 
-        # set up the workspace layers full path names
-        in_features = []
-        for feature in buffer_list:
-            in_features.append(os.path.join(config_dict.get('arcpy_gdb'), feature))
-        logging.debug(f"Intersect in_features names: {in_features}")
+        # set up the workspace layers full path names, a layer listed twice is only passed to the intersect once
+        in_features = list(dict.fromkeys(gdb_path(feature) for feature in buffer_list))
+        logging.debug("Intersect in_features names: %s", in_features)
 
-        # set up the workspace output layer name
-        out_feature = os.path.join(f"{config_dict.get('arcpy_gdb')}", intersect_layer)
-        logging.debug(f"Intersect out_feature: {out_feature}")
+        # set up the memory output layer name
+        out_feature = f"memory\\{layer_name}"
+        logging.debug("Intersect out_feature: %s", out_feature)
 
         # call the intersect analysis
         arcpy.analysis.Intersect(in_features=in_features,
                                  out_feature_class=out_feature)
 
-        logging.info(f"Intersect '{intersect_layer}' complete")
-        return intersect_layer
+        _MEMORY_LAYERS.add(layer_name)
+        logging.info("Intersect '%s' complete", layer_name)
+        return layer_name
 
     except Exception as e:
         print(f"Error encountered in interset: {e}")
 
 
-def spatial_join(target_layer: str, join_layer: str, default_layer_name: str="spatial_join_layer"):
+def spatial_join(target_layer: str, join_layer: str, default_layer_name: str="spatial_join_layer",
+                 layer_name: str=None):
     """
-    Uses the spatial join analysis for incoming target and join layer
+    Creates the layer of target features that fall within the join layer, the same features a one to one KEEP_COMMON
+    spatial join would keep, using a select by location and copy
     :param target_layer: the addresses to be used
     :param join_layer: the intersect layer which will be added to the target layer
+    :param layer_name: the name of the layer to create, asked for when not provided
     :return spatial_join_layer: the layer of the spatial join that was created
     """
 
-    logging.info(f"Starting the spatial join analysis")
+    logging.info("Starting the spatial join analysis")
     try:
-        spatial_join_layer = get_valid_layer_name(default_layer_name)
+        spatial_join_layer = layer_name or get_valid_layer_name(default_layer_name)
 
         # check if the layer exists, delete it if it does
         delete_existing_layer(spatial_join_layer)
 
         # perform the spatial analysis
-        logging.info(f"Creating '{spatial_join_layer}' between '{target_layer}' and '{join_layer}'")
-
-        target_feature = os.path.join(f"{config_dict.get('arcpy_gdb')}", target_layer)
-        logging.debug(f"spatial join target_feature: {target_feature}")
-        join_feature = os.path.join(f"{config_dict.get('arcpy_gdb')}", join_layer)
-        logging.debug(f"spatial join join_feature: {join_feature}")
-        out_feature = os.path.join(f"{config_dict.get('arcpy_gdb')}", spatial_join_layer)
-        logging.debug(f"spatial join out_feature: {out_feature}")
-
-        # call the spatial join analysis
-        arcpy.analysis.SpatialJoin(target_features=target_feature,
-                                   join_features=join_feature,
-                                   out_feature_class=out_feature,
-                                   join_operation="JOIN_ONE_TO_ONE",
-                                   join_type="KEEP_COMMON",
-                                   match_option="WITHIN")
-
-        logging.info(f"Spatial join '{spatial_join_layer}' complete")
+        logging.info("Creating '%s' between '%s' and '%s'", spatial_join_layer, target_layer, join_layer)
+
+        target_feature = gdb_path(target_layer)
+        logging.debug("spatial join target_feature: %s", target_feature)
+        join_feature = gdb_path(join_layer)
+        logging.debug("spatial join join_feature: %s", join_feature)
+        out_feature = gdb_path(spatial_join_layer)
+        logging.debug("spatial join out_feature: %s", out_feature)
+
+        # make sure the addresses have a spatial index for the location selection, setup already indexed the inputs
+        indexed = config_dict.setdefault('_indexed', set())
+        if target_layer.lower() not in indexed:
+            arcpy.management.AddSpatialIndex(target_feature)
+            indexed.add(target_layer.lower())
+
+        # select the addresses within the join layer and copy them, this keeps only the matching addresses like a
+        # KEEP_COMMON spatial join without building the joined attributes
+        selection = arcpy.management.SelectLayerByLocation(in_layer=target_feature,
+                                                           overlap_type="WITHIN",
+                                                           select_features=join_feature,
+                                                           selection_type="NEW_SELECTION")
+        arcpy.management.CopyFeatures(in_features=selection,
+                                      out_feature_class=out_feature)
+
+        # every copied address is within one area, add the join count a spatial join would have created
+        arcpy.management.CalculateField(in_table=out_feature,
+                                        field="Join_Count",
+                                        expression="1",
+                                        expression_type="PYTHON3",
+                                        field_type="LONG")
+
+        _EXISTING_LAYERS.add(spatial_join_layer.lower())
+        logging.info("Spatial join '%s' complete", spatial_join_layer)
         return spatial_join_layer
 
     except Exception as e:
         print(f"Error encountered in spatial_join: {e}")
 
 
-def erase(in_layer: str, erase_layer: str, default_layer_name: str="erased_layer"):
+def erase(in_layer: str, erase_layer: str, default_layer_name: str="erased_layer", layer_name: str=None):
     """
     Uses the addresses created from the ETL file, and erases those addresses from the concerned mosquito areas
     :param in_layer: layer name for the mosquito areas of concern - layer which has all addresses
     :param erase_layer: layer name from ETL file which has the addresses to avoid - it will be erased from in_layer
+    :param layer_name: the name of the layer to create, asked for when not provided
     :return: output_layer: name of the generated layer - it will contain the addresses which can be sprayed
     """
 
-    logging.debug(f"Starting the erase analysis")
+    logging.debug("Starting the erase analysis")
 
     try:
         # get a name from the user for the new layer that will have the addresses removed from it
-        print(f"Erasing '{erase_layer}' points from '{in_layer}' - Create a name for the new layer that will be created.")
-        output_layer = get_valid_layer_name(default_layer_name)
+        output_layer = layer_name
+        if not output_layer:
+            print(f"Erasing '{erase_layer}' points from '{in_layer}' - "
+                  "Create a name for the new layer that will be created.")
+            output_layer = get_valid_layer_name(default_layer_name)
 
         # check if the layer exists, delete it if it does
         delete_existing_layer(output_layer)
 
         # perform the erase of features
-        logging.info(f"Erasing areas to avoid spraying. Creating '{output_layer}'.")
+        logging.info("Erasing areas to avoid spraying. Creating '%s'.", output_layer)
 
         # set up the layers full path
-        in_features = os.path.join(f"{config_dict.get('arcpy_gdb')}", in_layer)
-        logging.debug(f"erase in_features: {in_features}")
-        erase_features = os.path.join(f"{config_dict.get('arcpy_gdb')}", erase_layer)
-        logging.debug(f"erase erase_features: {erase_features}")
-        out_feature = os.path.join(f"{config_dict.get('arcpy_gdb')}", output_layer)
-        logging.debug(f"erase out_feature: {out_feature}")
+        in_features = gdb_path(in_layer)
+        logging.debug("erase in_features: %s", in_features)
+        erase_features = gdb_path(erase_layer)
+        logging.debug("erase erase_features: %s", erase_features)
+        out_feature = gdb_path(output_layer)
+        logging.debug("erase out_feature: %s", out_feature)
 
         # call the erase analysis
         arcpy.analysis.Erase(in_features=in_features,
                              erase_features=erase_features,
                              out_feature_class=out_feature)
 
-        logging.info(f"Erase layer '{output_layer}' complete.")
+        _EXISTING_LAYERS.add(output_layer.lower())
+        logging.info("Erase layer '%s' complete.", output_layer)
         return output_layer
 
     except Exception as e:
         print(f"Error encountered in erase: {e}")
 
 
-def spatial_selection(intersect_layer: str, select_layer: str):
-    """
-    Does a quick check for how many features are found within a layer
-    :param intersect_layer: the boulder address layer name
-    :param select_layer: areas to avoid buffer layer name
-    :return: the number from the select by location - the number of addresses that fall within the buffer layer, which
-        are the number of addresses that should not be sprayed
-    """
-
-    logging.debug("Entered spatial_selection")
-
-    try:
-        in_layer = os.path.join(f"{config_dict.get('arcpy_gdb')}", intersect_layer)
-        logging.debug(f"spatial selection in_layer: {in_layer}")
-        select_features = os.path.join(f"{config_dict.get('arcpy_gdb')}", select_layer)
-        logging.debug(f"spatial selection select_features: {select_features}")
-
-        # call the select layer by location
-        address_to_inform = arcpy.management.SelectLayerByLocation(in_layer=in_layer,
-                                                                   overlap_type="WITHIN",
-                                                                   select_features=select_features,
-                                                                   selection_type="NEW_SELECTION")
-        # get the count from the selected items
-        count = int(arcpy.GetCount_management(address_to_inform)[0])
-        logging.debug(f"spatial selection number: {count}")
-        logging.debug("Exiting spatial_selection")
-        return count
-
-    except Exception as e:
-        print(f"Error encountered in spatial_selection: {e}")
-
-
 def export_map(display_layers: list, address_layer: str, target_layer: str):
     """
     Exports the layout from the project to a pdf
-    Removes all current layers form the map then pdates which layers are in the map
+    Removes the layers that will not be displayed from the map and adds the display layers that are missing
     Updates how layers look in the final map
     Updates the title with a subtitle
     Updates the date that will be on the layout
@@ -312,70 +676,54 @@ def export_map(display_layers: list, address_layer: str, target_layer: str):
 
     try:
         # get the project path and layout
-        proj_path = f"{config_dict.get('arcpy_workspace')}"
-        aprx = arcpy.mp.ArcGISProject(rf"{proj_path}\WestNileOutbreak.aprx")
+        aprx, map_doc, layout = get_project()
 
         # set up the variables needed
-        map_doc = aprx.listMaps()[0]
-        layout = aprx.listLayouts()[0]
         map_frame = layout.listElements("MAPFRAME_ELEMENT")[0]
         layer_extent = None
 
-        # display the layers to display
+        # only remove the layers that are not going to be displayed, or that are a second copy of a layer already in
+        # the map, the first copy of each display layer is kept as it is
+        wanted = set(display_layers)
+        current = set()
         for lyr in map_doc.listLayers():
-            logging.debug(f"Layer removed: {lyr}")
-            map_doc.removeLayer(lyr)
+            if lyr.name in wanted and lyr.name not in current:
+                current.add(lyr.name)
+            else:
+                logging.debug("Layer removed: %s", lyr)
+                map_doc.removeLayer(lyr)
 
-        # add the layers back to the map
+        # add the layers to display that are not in the map yet
         for lyr in display_layers:
-            map_doc.addDataFromPath(rf"{proj_path}\WestNileOutbreak.gdb\{lyr}")
-            logging.debug(f"Layer added back to map: {lyr}")
+            if lyr not in current:
+                map_doc.addDataFromPath(gdb_path(lyr))
+                current.add(lyr)
+                logging.debug("Layer added to map: %s", lyr)
 
         # save the project as it is
         aprx.save()
 
+        # look up the symbology by layer name, including the layers that were named during this run
+        symbology = dict(_SYMBOLOGY)
+        symbology[target_layer] = _TARGET_SYMBOLOGY
+        symbology[address_layer] = _ADDRESS_SYMBOLOGY
+
         # update the symbology
         for lyr in map_doc.listLayers():
-            if lyr.name == "Lakes_and_Reservoirs":
-                sym = lyr.symbology
-                sym.renderer.symbol.color = {'RGB': [115, 223, 2550, 100]}
-                # set the outline
-                sym.renderer.symbol.outlineColor = {'RGB': [0, 112, 255, 100]}
-                # apply it to the layer
-                lyr.symbology = sym
-
-            if lyr.name == "Wetlands":
-                sym = lyr.symbology
-                sym.renderer.symbol.color = {'RGB': [211, 255, 190, 100]}
-                sym.renderer.symbol.outlineColor = {'RGB':[110, 110, 110, 100]}
-                lyr.symbology = sym
-
-            if lyr.name == "Mosquito_Larval_Sites":
-                sym = lyr.symbology
-                sym.renderer.symbol.color = {'RGB': [255, 255, 115, 100]}
-                sym.renderer.symbol.outlineColor = {'RGB': [0, 0, 0, 100]}
-                lyr.symbology = sym
-
-            if lyr.name == "OSMP_Properties":
-                sym = lyr.symbology
-                sym.renderer.symbol.color = {'RGB': [56, 168, 0, 100]}
-                sym.renderer.symbol.outlineColor = {'RGB': [110, 110, 110, 100]}
-                lyr.symbology = sym
+            spec = symbology.get(lyr.name)
+            if spec is None:
+                continue
+
+            sym = lyr.symbology
+            # set the fill and the outline
+            sym.renderer.symbol.color, sym.renderer.symbol.outlineColor = spec
+            # apply it to the layer
+            lyr.symbology = sym
 
             if lyr.name == target_layer:
-                sym = lyr.symbology
-                sym.renderer.symbol.color = {'RGB': [255, 0, 0, 50]}
-                sym.renderer.symbol.outlineColor = {'RGB': [0, 0, 0, 50]}
-                lyr.symbology = sym
                 # zoom to this layer in the map frame
                 layer_extent = lyr
 
-            if lyr.name == address_layer:
-                sym = lyr.symbology
-                sym.renderer.symbol.color = {'RGB': [156, 156, 156, 100]}
-                sym.renderer.symbol.outlineColor = {'RGB': [0, 0, 0, 100]}
-                lyr.symbology = sym
-
         # change the baselayer map
         map_doc.addBasemap("Community Map")
 
@@ -409,100 +757,189 @@ def export_map(display_layers: list, address_layer: str, target_layer: str):
         layout.exportToPDF(out_pdf=map_pdf)
 
         print(f"Map exported: {map_pdf}")
-        logging.info(f"Map exported: {map_pdf} at {today_str}")
+        logging.info("Map exported: %s at %s", map_pdf, today_str)
         logging.debug("Exiting export_map")
 
     except Exception as e:
         print(f"Error encountered in export_map: {e}")
 
 
-def add_layer_to_project(layer_name: str):
+def get_project():
     """
-    Function to add an incoming layer to the project and saves the project
-    :param layer_name: the name of the layer to add to the project
-    :return: null
+    Function to get the ArcGIS project with its first map and layout. The project is only opened once and the same
+    handles are reused until the project is saved, since opening it parses the whole .aprx file
+    :return aprx, map_doc, layout: the ArcGIS project, its first map, and its first layout
     """
 
-    logging.info(f"Adding {layer_name} to project.")
+    if 'aprx' not in _APRX_CACHE:
+        logging.debug("Opening project %s", APRX_PATH)
+        _APRX_CACHE['aprx'] = arcpy.mp.ArcGISProject(APRX_PATH)
+        _APRX_CACHE['map'] = _APRX_CACHE['aprx'].listMaps()[0]
+        _APRX_CACHE['layout'] = _APRX_CACHE['aprx'].listLayouts()[0]
+    return _APRX_CACHE['aprx'], _APRX_CACHE['map'], _APRX_CACHE['layout']
 
-    try:
-        proj_path = f"{config_dict.get('arcpy_workspace')}"
-        aprx = arcpy.mp.ArcGISProject(rf"{proj_path}\WestNileOutbreak.aprx")
 
-        # get the list of maps in the project, and select the 1st one
-        map_doc = aprx.listMaps()[0]
+def save_project():
+    """
+    Function to save the ArcGIS project once all the layers have been added to it
+    :return: null
+    """
 
-        # add the layer to the project
-        map_doc.addDataFromPath(rf"{proj_path}\WestNileOutbreak.gdb\{layer_name}")
+    logging.info("Saving project.")
 
-        # save the project
+    try:
+        aprx, map_doc, layout = get_project()
         aprx.save()
+        logging.info("Project saved.")
 
-        logging.info(f"'{layer_name}' added to project map.")
+        # the project is opened again the next time it is needed
+        _APRX_CACHE.clear()
 
     except OSError as e:
-        logging.error(f"Could not add layer '{layer_name}' to project")
-        logging.error(f"Error encountered: {e}")
+        logging.error("Could not save the project")
+        logging.error("Error encountered: %s", e)
         logging.error("Try closing ArcPro and try again.")
 
     except Exception as e:
-        print(f"Error encountered in add_layer_to_project: {e}")
+        print(f"Error encountered in save_project: {e}")
 
 
-def query_by_attribute(layer_name: str, query: str, selection: str="NEW_SELECTION"):
+def add_layers_to_project(layer_names: list[str]):
     """
-    Function to run a query by attribute
-    :param layer_name: the layer to query
-    :param query: the where clause of the query to use against the layer
-    :param selection: the selection type to use in query, default is new selection
-    :return count_result: the number that was found from the query
+    Function to add the incoming layers to the project in one pass. The project is saved at the end of the program
+    by save_project
+    :param layer_names: the names of the layers to add to the project
+    :return: null
     """
 
-    logging.info(f"Querying '{layer_name}' with query '{query}' as '{selection}'")
+    logging.info("Adding %s to project.", layer_names)
+
     try:
+        # get the first map in the project
+        aprx, map_doc, layout = get_project()
+
+        # add the layers to the project, a layer that is already in the map from an earlier run is not added again
+        current = {lyr.name for lyr in map_doc.listLayers()}
+        for layer_name in layer_names:
+            if layer_name in current:
+                logging.info("'%s' is already in the project map.", layer_name)
+                continue
+            map_doc.addDataFromPath(gdb_path(layer_name))
+            current.add(layer_name)
+            logging.info("'%s' added to project map.", layer_name)
+
+    except Exception as e:
+        print(f"Error encountered in add_layers_to_project: {e}")
+
+
+def count_features(layer_name: str, query: str = None):
+    """
+    Function to count the features of a layer, optionally only the ones that match a query by attribute. The features
+    are counted with a search cursor so no selection layer has to be created
+    :param layer_name: the layer to count
+    :param query: the where clause of the query to use against the layer, all features are counted if not provided
+    :return count_result: the number of features found, or None if the layer could not be counted
+    """
+
+    logging.info("Counting '%s' with query '%s'", layer_name, query)
+    try:
+        # an earlier step that failed returns no layer name, so there is nothing to count
+        if not layer_name:
+            raise ValueError("no layer to count, an earlier step did not create it")
+
         # set up the layer full path name
-        in_layer = os.path.join(f"{config_dict.get('arcpy_gdb')}", layer_name)
-        logging.debug(f"query by attribute in_layer: {in_layer}")
-
-        # call select layer by attribute
-        query_result = arcpy.management.SelectLayerByAttribute(in_layer_or_view=in_layer,
-                                                               selection_type=selection,
-                                                               where_clause=query)
-        # get a count of the number
-        count_result = arcpy.management.GetCount(query_result)
-        logging.debug(f"count result from query number: {count_result}")
-        logging.debug("Exiting query_by_attribute")
+        in_layer = gdb_path(layer_name)
+        logging.debug("count features in_layer: %s", in_layer)
+
+        # count the object ids of the features that match the query
+        with arcpy.da.SearchCursor(in_layer, ['OID@'], where_clause=query) as cursor:
+            count_result = sum(1 for _ in cursor)
+        logging.debug("count result number: %s", count_result)
+        logging.debug("Exiting count_features")
         return count_result
 
     except Exception as e:
-        print(f"Error encountered in query_by_attribute: {e}")
+        print(f"Error encountered in count_features: {e}")
 
 
 def delete_existing_layer(layer_name: str):
     """
-    Function that deletes a layer if it exists
+    Function that deletes a layer if it exists. When overwriting is allowed the geoprocessing tools replace the
+    layer themselves, so the existence check is skipped. Otherwise the layers listed in setup are checked
     :param layer_name: layer name to check if it exists in the geodatabase
     :return: null
     """
 
     logging.debug("Entered deleted_existing_layer method")
 
+    if arcpy.env.overwriteOutput:
+        logging.debug("'%s' will be overwritten if it exists", layer_name)
+        return
+
     try:
-        layer = os.path.join(f"{config_dict.get('arcpy_gdb')}", layer_name)
-        logging.debug(f"delete layer name: {layer}")
+        layer = gdb_path(layer_name)
+        logging.debug("delete layer name: %s", layer)
 
         # check if the layer exists, delete it if it does
-        if arcpy.Exists(layer):
-            logging.warning(f"'{layer_name}' already exists - deleting existing layer")
+        if layer_name.lower() in _EXISTING_LAYERS:
+            logging.warning("'%s' already exists - deleting existing layer", layer_name)
             arcpy.Delete_management(layer)
+            _EXISTING_LAYERS.discard(layer_name.lower())
         else:
-            logging.info(f"'{layer_name}' does not exist yet")
+            logging.info("'%s' does not exist yet", layer_name)
         logging.debug("Exiting deleted_existing_layer")
 
     except Exception as e:
         print(f"Error encountered in delete_existing_layer: {e}")
 
 
+def get_parameter(section: str, key: str):
+    """
+    Looks up an answer preset in the parameters block of the config, so the prompt for it can be skipped
+    :param section: the section of the parameters block, buffers or layer_names
+    :param key: the layer the answer is for
+    :return: the preset answer, or None when the user has to be prompted
+    """
+
+    parameters = config_dict.get('parameters') or {}
+    return (parameters.get(section) or {}).get(key)
+
+
+def get_session_answer(key: str):
+    """
+    Looks up the answer that was given to a prompt on the last run, so repeat runs do not need to retype it
+    :param key: the prompt the answer was given to
+    :return: the saved answer, or None when the user has to be prompted
+    """
+
+    if ARGS.interactive or key not in _SESSION:
+        return None
+
+    answer = _SESSION[key]
+    print(f"{key.strip()}: using {answer} from the last run (run with --interactive to be asked again)")
+    logging.info("Reusing answer '%s' for '%s'", answer, key)
+    return answer
+
+
+def save_session_answer(key: str, answer):
+    """
+    Saves the answer given to a prompt so it can be reused on the next run
+    :param key: the prompt the answer was given to
+    :param answer: the answer given by the user
+    :return: null
+    """
+
+    _SESSION[key] = answer
+    if SESSION_PATH is None:
+        return
+
+    try:
+        with open(SESSION_PATH, 'w') as f:
+            json.dump(_SESSION, f, indent=2)
+    except OSError as e:
+        logging.warning("Could not save the session answers to %s: %s", SESSION_PATH, e)
+
+
 def get_number(prompt: str="Enter a number", num_type=float, default=None):
     """
     Function to prompt the end user to enter a number to use for buffering the layer
@@ -515,6 +952,12 @@ def get_number(prompt: str="Enter a number", num_type=float, default=None):
     logging.debug("Entering get_number")
 
     try:
+        # reuse the answer from the last run
+        saved = get_session_answer(prompt)
+        if saved is not None:
+            logging.debug("Exiting get_number")
+            return num_type(saved)
+
         # determine the full prompt to show the user
         if default == None:
             full_prompt = f"{prompt}: "
@@ -527,14 +970,21 @@ def get_number(prompt: str="Enter a number", num_type=float, default=None):
 
             # Return default if input is empty
             if user_input == "" and default is not None:
+                save_session_answer(prompt, default)
                 logging.debug("Exiting get_number")
                 return default
 
-            # check the input
+            # check the input looks like a number before converting it
+            if not _NUM_RE.fullmatch(user_input):
+                print(f"Invalid input. Please enter a valid {num_type.__name__}.")
+                continue
+
             try:
                 # Convert input to the specified type
+                number = num_type(user_input)
+                save_session_answer(prompt, number)
                 logging.debug("Exiting get_number")
-                return num_type(user_input)
+                return number
             except ValueError:
                 print(f"Invalid input. Please enter a valid {num_type.__name__}.")
 
@@ -542,46 +992,46 @@ def get_number(prompt: str="Enter a number", num_type=float, default=None):
         print(f"Error encountered in get_number: {e}")
 
 
-def get_units_for_buffer():
+def get_units_for_buffer(session_key: str="Select a unit for buffering"):
     """
     Function to prompt the end user to select an option for which buffer unit to be used for the buffer layer
+    :param session_key: the key the selected unit is saved under for the next run, default is the menu title
     :return selected_unit: a unit that is acceptable for use within the buffer analysis; default is feet
     """
 
     logging.debug("Entering get_units_for_buffer")
 
     try:
-        # Define a list of acceptable units
-        valid_units = config_dict.get('valid_units')
-        default_unit = config_dict.get('default_unit')
+        # reuse the unit from the last run
+        saved = get_session_answer(session_key)
+        if saved in VALID_UNITS:
+            logging.debug("Exiting unit select")
+            return saved
 
         # Print the list of units to the user for unit selection
         print("Select a unit for buffering:")
-        for i, unit in enumerate(valid_units, 1):
-            print(f"{i}. {unit}")
+        print(UNIT_MENU)
+        unit_prompt = f"Enter the number or name of your choice (Press Enter for {DEFAULT_UNIT}): "
+        unit_choices = UNIT_CHOICES
 
         # Get user input and validate, continue loop until valid selection is made
         while True:
-            user_input = input(f"Enter the number for your choice (Press Enter for {default_unit}): ").strip()
+            user_input = input(unit_prompt).strip()
 
             # Return default unit if input is empty
             if user_input == "":
+                save_session_answer(session_key, DEFAULT_UNIT)
                 logging.debug("Exiting unit select")
-                return default_unit
+                return DEFAULT_UNIT
 
-            # Validate the entered selection
-            try:
-                unit_choice = int(user_input)
-                # check that the input number is within the list
-                if 1 <= unit_choice <= len(valid_units):
-                    selected_unit = valid_units[unit_choice - 1]
-                    # return the valid unit to buffer
-                    logging.debug("Exiting unit select")
-                    return selected_unit
-                else:
-                    print("Invalid selection. Please enter a number from the list.")
-            except ValueError:
-                print("Invalid input. Please enter a valid number.")
+            # Validate the entered selection, a number, name or unique first letter from the list
+            selected_unit = unit_choices.get(user_input.lower())
+            if selected_unit is not None:
+                save_session_answer(session_key, selected_unit)
+                # return the valid unit to buffer
+                logging.debug("Exiting unit select")
+                return selected_unit
+            print("Invalid selection. Please enter a number or name from the list.")
 
     except Exception as e:
         print(f"Error encountered in get_units_for_buffer: {e}")
@@ -589,32 +1039,30 @@ def get_units_for_buffer():
 
 def is_valid_layer_name(layer_name: str):
     """
-    Function to check for invalid characters, spaces, starting number or starting hyphen
+    Function to check that the layer name only uses letters, numbers and underscores and does not start with a number.
+    Raises a ValueError describing the first rule an invalid name breaks
     :param layer_name: the layer name that was entered
     :return: true if it passes
     """
 
-    # Define invalid characters pattern (special characters)
-    invalid_chars = r'[!@#$%^&*()+=;:\'",.<>/\?\\|\[\]{}`~]'
+    # a valid name passes with a single match
+    if _VALID_LAYER_NAME.fullmatch(layer_name):
+        return True
 
-    # Check if the name contains spaces
+    # otherwise work out which rule the name breaks
     if ' ' in layer_name:
         raise ValueError("Layer name cannot contain spaces.")
 
-    # Check if the name contains invalid characters
-    if re.search(invalid_chars, layer_name):
-        raise ValueError("Layer name contains invalid characters.")
-
-    # Check if the name starts with a hyphen
     if layer_name[0] == '-':
         raise ValueError("Layer name cannot start with a hyphen.")
 
-    # Check if the name starts with a number
     if layer_name[0].isdigit():
         raise ValueError("Layer name cannot start with a number.")
 
-    # Return true if everything passes successfully
-    return True
+    if len(layer_name) > 160:
+        raise ValueError("Layer name cannot be longer than 160 characters.")
+
+    raise ValueError("Layer name contains invalid characters.")
 
 
 def get_valid_layer_name(default_layer_name: str=None) -> str:
@@ -626,6 +1074,18 @@ def get_valid_layer_name(default_layer_name: str=None) -> str:
     logging.debug("Entering get_valid_layer_name")
 
     try:
+        # use the layer name preset in the parameters block of the config
+        preset = get_parameter('layer_names', default_layer_name)
+        if preset:
+            try:
+                if is_valid_layer_name(preset):
+                    print(f"Using layer name '{preset}' from the config")
+                    logging.info("Layer name used: %s", preset)
+                    logging.debug("Exiting get_valid_layer_name")
+                    return preset
+            except ValueError as e:
+                print(f"Invalid layer name '{preset}' in the config: {e}")
+
         # provide the default layer name if one was provided
         if default_layer_name != None:
             print(f"Press enter to use the default layer name '{default_layer_name}'")
@@ -637,7 +1097,7 @@ def get_valid_layer_name(default_layer_name: str=None) -> str:
 
                 # Return default layer name
                 if layer_name == "" and default_layer_name is not None:
-                    logging.info(f"Layer name used: {layer_name}")
+                    logging.info("Layer name used: %s", layer_name)
                     logging.debug("Exiting get_valid_layer_name")
                     return default_layer_name
 
@@ -648,7 +1108,7 @@ def get_valid_layer_name(default_layer_name: str=None) -> str:
                 # Check if the name is valid
                 if is_valid_layer_name(layer_name):
                     print(f"Valid layer name entered: {layer_name}")
-                    logging.debug(f"Layer name entered: {layer_name}")
+                    logging.debug("Layer name entered: %s", layer_name)
                     # return the layer name entered
                     logging.debug("Exiting get_valid_layer_name")
                     return layer_name
@@ -670,111 +1130,187 @@ def ask_to_continue(prompt: str="Would you like to continue?"):
     logging.debug("Entering ask_to_continue")
 
     try:
-        # Define a list of acceptable answers
-        valid_answers = config_dict.get('valid_answers_y_n')
+        # answer yes without asking when --yes was passed
+        if ARGS.yes:
+            logging.info("%s %s", prompt, VALID_YN[0])
+            logging.debug("Exiting ask_to_continue")
+            return VALID_YN[0]
+
+        # reuse the answer from the last run
+        saved = get_session_answer(prompt)
+        if saved in VALID_YN:
+            logging.debug("Exiting ask_to_continue")
+            return saved
 
         # inform the user of the selection to use
         print(f"{prompt}")
-        for i, answer in enumerate(valid_answers, 1):
-            print(f"{i}. {answer}")
+        print(YN_MENU)
 
         # Get user input and validate, continue loop until valid selection is made
+        answer_choices = YN_CHOICES
+        # the short answers that can be typed, the first letter of each answer from the config when it is unique
+        short_answers = " or ".join(answer[0].lower() if answer_choices.get(answer[0].lower()) == answer
+                                    else answer for answer in VALID_YN)
         while True:
-            user_input = input(f"Enter the number for your choice: ").strip()
+            user_input = input(f"Enter {short_answers}, or the number of your choice: ").strip()
 
-            # Validate the entered selection
-            try:
-                user_choice = int(user_input)
-                # check that the input number is within the list
-                if 1 <= user_choice <= len(valid_answers):
-                    choice = valid_answers[user_choice - 1]
-                    # return the valid unit to buffer
-                    logging.debug("Exiting ask_to_continue")
-                    return choice
-                else:
-                    print("Invalid selection. Please enter a number from the list.")
-            except ValueError:
-                print("Invalid input. Please enter a valid number.")
+            # Validate the entered selection, a number, answer or first letter from the list
+            choice = answer_choices.get(user_input.lower())
+            if choice is not None:
+                save_session_answer(prompt, choice)
+                logging.debug("Exiting ask_to_continue")
+                return choice
+            print(f"Invalid selection. Please enter {short_answers}, or a number from the list.")
 
     except Exception as e:
         print(f"Error encountered in ask_to_continue: {e}")
 
 
+@dataclass(frozen=True)
+class PipelinePlan:
+    """
+    All the answers the analysis needs, gathered by plan_pipeline before any geoprocessing runs
+    """
+
+    # layers that exist in gdb which will be buffered, with the output layer name and distance for each
+    layers_to_buffer: tuple[str, ...]
+    buffer_specs: tuple[tuple[str, str], ...]
+    # names for the layers the analysis creates
+    spatial_join_layer: str
+    address_to_spray: str
+    targeted_area: str
+    # whether the spatial join layer is added to the project map
+    add_spatial_join: bool
+    # the output layer name and distance for the avoid points buffer
+    avoid_buffer_spec: tuple[str, str]
+
+
+def plan_pipeline(layers_to_buffer: list[str]) -> PipelinePlan:
+    """
+    Asks for every buffer distance, layer name and choice up front, so the analysis can then run without stopping for
+    input and a typo is caught before any geoprocessing has been done
+    :param layers_to_buffer: the layers in the gdb which will be buffered
+    :return plan: the answers for the analysis
+    """
+
+    logging.debug("Entering plan_pipeline")
+
+    # buffer distances for the input layers
+    buffer_specs = tuple(get_buffer_distance(layer_name) for layer_name in layers_to_buffer)
+
+    # names for the analysis layers, the intersect is only kept in memory so it does not need a name
+    print("Create a name for the layer of addresses within the concerned mosquito areas.")
+    spatial_join_layer = get_valid_layer_name("address_in_concern_areas")
+    answer = ask_to_continue(prompt=f"Would you like to add '{spatial_join_layer}' to the project map?")
+
+    # buffer distance for the areas to avoid and names for the layers erased from them
+    avoid_buffer_spec = get_buffer_distance(config_dict.get('avoid_points'))
+    print("Create a name for the layer of addresses to spray.")
+    address_to_spray = get_valid_layer_name("addresses_to_spray")
+    print("Create a name for the layer of the targeted areas to spray.")
+    targeted_area = get_valid_layer_name("targeted_area")
+
+    logging.debug("Exiting plan_pipeline")
+    return PipelinePlan(layers_to_buffer=tuple(layers_to_buffer),
+                        buffer_specs=buffer_specs,
+                        spatial_join_layer=spatial_join_layer,
+                        address_to_spray=address_to_spray,
+                        targeted_area=targeted_area,
+                        add_spatial_join=answer == "Yes",
+                        avoid_buffer_spec=avoid_buffer_spec)
+
+
 def main():
     """
     Main function which calls all the other functions found within the file
     :return: 0 if script is successful, 1 if it fails
     """
-    global config_dict
+    global config_dict, ARGS
 
     try:
+        ARGS = parse_args()
         config_dict = setup()
+
+        # an unknown unit on the command line is asked for instead
+        if ARGS.buffer_unit and ARGS.buffer_unit not in VALID_UNITS:
+            print(f"'{ARGS.buffer_unit}' is not a valid buffer unit, you will be asked for the unit instead.")
+            logging.warning("'%s' is not a valid buffer unit", ARGS.buffer_unit)
+
         logging.info("Starting West Nile Virus Simulation")
 
         # set the spatial reference
         set_spatial_reference()
 
         # layers that exist in gdb which will be buffered
-        layers_to_buffer = ["Lakes_and_Reservoirs", "Wetlands", "Mosquito_Larval_Sites", "OSMP_Properties"]
-        # list of buffered layers that will be used for intersect function
-        buffer_layer_list = []
-        # buffer the layers that need to be buffered
-        for layer in layers_to_buffer:
-            buffered_layer = buffer(layer)
-            # add the name to the list of buffered layers
-            buffer_layer_list.append(buffered_layer)
-
-        # intersect the buffered layers
-        print("Creating an intersect layer of the buffered layer list.")
+        layers_to_buffer = list(LAYERS_TO_BUFFER)
+
+        # ask for everything up front, the analysis below then runs without stopping for input
+        # the download and geocoding for the addresses to avoid, based on the Google opt-out form, mostly wait on the
+        # network so they run in the background while the questions are answered. The background part does not use
+        # arcpy, which is not thread safe, and only logs so nothing is printed over the prompts
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            etl_future = executor.submit(etl_extract)
+            plan = plan_pipeline(layers_to_buffer)
+            etl_state = etl_future.result()
+
+        # load the geocoded addresses on the main thread, arcpy is only used from here
+        etl_load(etl_state)
+
+        # buffer the layers that need to be buffered, the list of buffered layers will be used for intersect function
+        buffer_layer_list = buffer_layers(layers_to_buffer, buffer_specs=plan.buffer_specs)
+
+        # intersect the buffered layers, the intersect is only used by the analysis below so it is kept in memory
         intersect_layer = intersect(buffer_layer_list)
 
         # do a spatial join with the addresses that overlap the intersect layer
-        spatial_join_target = "Boulder_Addresses"
-        spatial_layer = spatial_join(spatial_join_target, intersect_layer, default_layer_name="address_in_concern_areas")
+        spatial_join_target = ADDRESS_LAYER
+        spatial_layer = spatial_join(spatial_join_target, intersect_layer, layer_name=plan.spatial_join_layer)
+
+        # inform the user the number of address that were found, every feature in the join layer is a match
+        qry_result = count_features(spatial_layer)
+        if qry_result is not None:
+            print(f"There are {qry_result} addresses found which fall within concerned mosquito areas.")
+            logging.info("There are %s addresses found which fall within concerned mosquito areas.", qry_result)
 
-        # inform the user the number of address that were found
-        qry = "Join_Count = 1"
-        qry_result = query_by_attribute(layer_name=spatial_layer, query=qry)
-        print(f"There are {qry_result} addresses found which fall within concerned mosquito areas.")
-        logging.info(f"There are {qry_result} addresses found which fall within concerned mosquito areas.")
+        # layers to add to the arcgis project, they are all added at once before the map is exported
+        layers_to_add = []
 
         # add the spatial join layer to the arcgis project
-        answer = ask_to_continue(prompt=f"Would you like to add '{spatial_layer}' to the project map?")
-        if answer == "Yes":
-            add_layer_to_project(spatial_layer)
+        if plan.add_spatial_join:
+            layers_to_add.append(spatial_layer)
         else:
             print(f"Will not add '{spatial_layer}' to the map")
-            logging.info(f"Will not add '{spatial_layer}' to the map")
-
-        # run the etc process for which addresses to avoid based on Google opt-out form
-        etl()
+            logging.info("Will not add '%s' to the map", spatial_layer)
 
-        # create a buffered area of where to avoid spraying
+        # create a buffered area of where to avoid spraying, it is only used by the erases so it is kept in memory
         avoid_points_layer = config_dict.get('avoid_points')
-        areas_to_avoid = buffer(avoid_points_layer)
+        areas_to_avoid = buffer(avoid_points_layer, buffer_spec=plan.avoid_buffer_spec)
 
         # erase the areas to avoid from the buffered area, which will create a new layer to use for addresses to spray
-        address_to_spray = erase(spatial_layer, areas_to_avoid, default_layer_name="addresses_to_spray")
-        add_layer_to_project(address_to_spray)
+        address_to_spray = erase(spatial_layer, areas_to_avoid, layer_name=plan.address_to_spray)
+        layers_to_add.append(address_to_spray)
 
-        # inform the user the number of addresses that will not be sprayed
-        address_count = spatial_selection(spatial_join_target, address_to_spray)
+        # inform the user the number of addresses that will be sprayed, the erase output already holds exactly the
+        # addresses that fall within it, so it is counted directly instead of selecting them again by location
+        address_count = count_features(address_to_spray)
         # num of addresses to notify
-        print(f"There are {address_count} addresses that will need treatment and must be notified.")
-        logging.info(f"There are {address_count} addresses that will need treatment and must be notified.")
+        if address_count is not None:
+            print(f"There are {address_count} addresses that will need treatment and must be notified.")
+            logging.info("There are %s addresses that will need treatment and must be notified.", address_count)
 
         # create the area layer where the spraying will occur after the avoid areas are removed
         # erase buff_avoid_points aka areas_to_avoid from intersect_layer
         print(f"Creating a layer for the targeted areas to spray")
-        targeted_area = erase(in_layer=intersect_layer, erase_layer=areas_to_avoid, default_layer_name="targeted_area")
+        targeted_area = erase(in_layer=intersect_layer, erase_layer=areas_to_avoid, layer_name=plan.targeted_area)
 
-        # add the layer to the project
-        add_layer_to_project(targeted_area)
+        # add the new layers to the project
+        layers_to_add.append(targeted_area)
+        add_layers_to_project(layers_to_add)
 
         # get a list of layers to use within the map - the original layers
         # wetlands_regulatory, osmp_properties, mosquito_larval_sites, lakes_and_reservoirs
         # final_analysis (an area) and target_addresses (the actual addresses)
-        layers_for_mapping = layers_to_buffer
+        layers_for_mapping = list(plan.layers_to_buffer)
         layers_for_mapping.append(targeted_area)
         layers_for_mapping.append(address_to_spray)
 
@@ -783,12 +1319,19 @@ def main():
 
         # create a csv file for the targeted addresses
 
+        # save the project once now that all the layers have been added
+        save_project()
+
+        # release the intermediate layers
+        arcpy.management.Delete("memory")
+        _MEMORY_LAYERS.clear()
+
         # Notify the end of the program
         logging.info("Script complete. Ending program.")
 
     except arcgisscripting.ExecuteError as e:
-        logging.error(f"Error encountered: {e}")
-        logging.error(f"Cannot run program. Try closing ArcGIS Pro before continuing.")
+        logging.error("Error encountered: %s", e)
+        logging.error("Cannot run program. Try closing ArcGIS Pro before continuing.")
 
 
 # Press the green button in the gutter to run the script.
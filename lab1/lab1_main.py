@@ -1,6 +1,45 @@
+import argparse
 import arcpy
-import re
+import os
+import shutil
+import string
+import tempfile
 import arcgisscripting
+from concurrent.futures import ProcessPoolExecutor
+
+# project locations
+PROJ_DIR = r"D:\jilli\Documents\ACC-RRCC\Spring_2025\GIS3005_GIS_Apps\labs\lab1\WestNileOutbreak"
+APRX_PATH = os.path.join(PROJ_DIR, "WestNileOutbreak.aprx")
+GDB_PATH = os.path.join(PROJ_DIR, "WestNileOutbreak.gdb")
+# characters a layer name can be made of
+ALLOWED_CHARS = frozenset(string.ascii_letters + string.digits + '_')
+# acceptable units for the buffer analysis
+VALID_UNITS = ["Feet", "Yards", "Miles", "Meters", "Kilometers"]
+# numbered menus for the selection prompts, each printed with a single call
+UNIT_MENU = "\n".join(f"{i}. {unit}" for i, unit in enumerate(VALID_UNITS, 1))
+YES_NO_MENU = "1. Yes\n2. No"
+# command line options, see parse_args
+ARGS = argparse.Namespace(buffer_dist=None, buffer_unit=None, yes=False)
+# opened ArcGIS projects with their first map, keyed by project path, see get_project
+_APRX_CACHE = {}
+
+
+def parse_args(argv: list[str]=None):
+    """
+    Reads the command line options, any option that is not given is asked for when it is needed
+    :param argv: the command line arguments, default is the arguments the script was run with
+    :return: the parsed options
+    """
+
+    parser = argparse.ArgumentParser(description="West Nile Virus outbreak analysis")
+    parser.add_argument('--buffer-dist', type=float,
+                        help="distance to buffer every layer by instead of asking for each layer")
+    parser.add_argument('--buffer-unit', type=str.capitalize, choices=VALID_UNITS,
+                        help="unit of the buffer distance")
+    parser.add_argument('--yes', action='store_true',
+                        help="answer yes to every yes or no question")
+    return parser.parse_args(argv)
+
 
 def setup():
     """
@@ -8,52 +47,113 @@ def setup():
     :return: null
     """
 
-    print("Setting up workspace")
-    print("CAUTION: all layers that are generated in this script may be overwritten or removed.")
+    print("Setting up workspace\n"
+          "CAUTION: all layers that are generated in this script may be overwritten or removed.")
     # Geodatabase location
-    arcpy.env.workspace = r"D:\jilli\Documents\ACC-RRCC\Spring_2025\GIS3005_GIS_Apps\labs\lab1\WestNileOutbreak\WestNileOutbreak.gdb"
+    arcpy.env.workspace = GDB_PATH
     # allow for overwriting
     arcpy.env.overwriteOutput = True
     print("Setup complete")
 
 
-def buffer(layer_name: str):
+def get_buffer_distance(layer_name: str):
     """
-    Buffer the incoming layer by a selected buffer distance
-    assumes the layer is preloaded in the ArcGIS project
+    Prompts the user for the buffer distance and unit to use for the incoming layer
     :param layer_name: the layer name that will be buffered
-    :return output_buffer_layer_name: the layer name that was created for the buffer analysis
+    :return output_buffer_layer_name, buff_dist: the layer name to create and the distance with units to buffer by
     """
 
     # create buffer layer name
     output_buffer_layer_name = f"buff_{layer_name}"
 
-    # get distance from user
-    prompt = f"Enter a distance for layer '{output_buffer_layer_name}' "
-    buff_num = get_number(prompt=prompt, num_type=float, default=1000)
+    # get distance from the command line, or from the user
+    if ARGS.buffer_dist is not None:
+        buff_num = ARGS.buffer_dist
+    else:
+        prompt = f"Enter a distance for layer '{output_buffer_layer_name}' "
+        buff_num = get_number(prompt=prompt, num_type=float, default=1000)
     print(f"You selected: {buff_num}")
 
-    # get unit from user
-    unit = get_units_for_buffer()
+    # get unit from the command line, or from the user
+    if ARGS.buffer_unit is not None:
+        unit = ARGS.buffer_unit
+    else:
+        unit = get_units_for_buffer()
     print(f"You selected: {unit}")
 
     # combine the distance and units as a string for buffer analysis
     buff_dist = str(buff_num) + " " + unit
+    return output_buffer_layer_name, buff_dist
 
-    # check if the layer exists, delete it if it does
-    delete_existing_layer(output_buffer_layer_name)
 
-    # perform the buffer analysis
-    print(f"Buffering '{layer_name}' to generate '{output_buffer_layer_name}' at {buff_dist}")
-    print("Please wait...")
-    arcpy.analysis.Buffer(in_features=layer_name,
-                          out_feature_class=output_buffer_layer_name,
-                          buffer_distance_or_field=buff_dist,
-                          line_side="FULL",
-                          line_end_type="ROUND",
-                          dissolve_option="ALL")
+def run_buffer(workspace: str, layer_name: str, output_buffer_layer_name: str, buff_dist: str):
+    """
+    Runs the buffer analysis without any prompts so it can be run in a worker process. The buffer is written to a new
+    scratch geodatabase, since several processes cannot safely write to the same file geodatabase at once
+    :param workspace: the geodatabase, passed in since worker processes start with a fresh arcpy environment
+    :param layer_name: the layer name that will be buffered
+    :param output_buffer_layer_name: the layer name that will be created for the buffer analysis
+    :param buff_dist: the distance and units to buffer by
+    :return scratch_features: the full path to the buffer in the scratch geodatabase
+    """
+
+    arcpy.env.workspace = workspace
+    arcpy.env.overwriteOutput = True
+
+    # every call gets its own scratch geodatabase, so workers never share one
+    scratch_gdb = arcpy.management.CreateFileGDB(tempfile.mkdtemp(prefix="buffer_"), "scratch.gdb")[0]
+    scratch_features = os.path.join(scratch_gdb, output_buffer_layer_name)
+
+    # the pairwise buffer always buffers both sides with round ends and runs on multiple cores
+    arcpy.analysis.PairwiseBuffer(in_features=layer_name,
+                                  out_feature_class=scratch_features,
+                                  buffer_distance_or_field=buff_dist,
+                                  dissolve_option="ALL")
     print(f"Buffer '{output_buffer_layer_name}' complete")
-    return output_buffer_layer_name
+    return scratch_features
+
+
+def buffer_layers(layer_names: list[str]):
+    """
+    Buffer the incoming layers by the selected buffer distances. The distances are asked for up front, then each
+    buffer analysis runs in its own process since the layers do not depend on each other
+    assumes the layers are preloaded in the ArcGIS project
+    :param layer_names: the layer names that will be buffered
+    :return buffer_layer_list: the layer names that were created for the buffer analysis, in the same order
+    """
+
+    # get all the distances from the user before running any analysis
+    output_names = []
+    buff_dists = []
+    for layer_name in layer_names:
+        output_buffer_layer_name, buff_dist = get_buffer_distance(layer_name)
+
+        # check if the layer exists, delete it if it does
+        delete_existing_layer(output_buffer_layer_name)
+
+        output_names.append(output_buffer_layer_name)
+        buff_dists.append(buff_dist)
+        # end with a new line for readability in console
+        print(f"Buffering '{layer_name}' to generate '{output_buffer_layer_name}' at {buff_dist}\n")
+
+    # perform the buffer analyses, arcpy is not thread safe so they run in separate processes
+    print("Please wait...")
+    with ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as executor:
+        scratch_features = list(executor.map(run_buffer,
+                                             [arcpy.env.workspace] * len(layer_names),
+                                             layer_names,
+                                             output_names,
+                                             buff_dists))
+
+    # the workers have exited, so copy the buffers into the project geodatabase one at a time and remove the scratch
+    # geodatabases
+    try:
+        for output_buffer_layer_name, scratch_feature in zip(output_names, scratch_features):
+            arcpy.management.CopyFeatures(scratch_feature, output_buffer_layer_name)
+    finally:
+        for scratch_feature in scratch_features:
+            shutil.rmtree(os.path.dirname(os.path.dirname(scratch_feature)), ignore_errors=True)
+    return output_names
 
 
 def intersect(buffer_list: list[str]):
@@ -72,8 +172,7 @@ def intersect(buffer_list: list[str]):
     delete_existing_layer(intersect_layer)
 
     # perform the intersect analysis
-    print(f"Using {buffer_list} to create '{intersect_layer}'")
-    print("Please wait...")
+    print(f"Using {buffer_list} to create '{intersect_layer}'\nPlease wait...")
     arcpy.analysis.Intersect(in_features=buffer_list,
                              out_feature_class=intersect_layer)
     print(f"Intersect '{intersect_layer}' complete")
@@ -95,8 +194,7 @@ def spatial_join(target_layer: str, join_layer: str):
     delete_existing_layer(spatial_join_layer)
 
     # perform the spatial analysis
-    print(f"Creating '{spatial_join_layer}' between '{target_layer}' and '{join_layer}'")
-    print("Please wait...")
+    print(f"Creating '{spatial_join_layer}' between '{target_layer}' and '{join_layer}'\nPlease wait...")
     arcpy.analysis.SpatialJoin(target_features=target_layer,
                                join_features=join_layer,
                                out_feature_class=spatial_join_layer)
@@ -105,49 +203,58 @@ def spatial_join(target_layer: str, join_layer: str):
     return spatial_join_layer
 
 
-def add_layer_to_project(layer_name: str):
+def get_project(aprx_path: str):
+    """
+    Function to get an ArcGIS project with its first map. Each project is only opened once and the same handles are
+    reused, since opening it parses the whole .aprx file
+    :param aprx_path: the path to the .aprx file
+    :return aprx, map_doc: the ArcGIS project and its first map
+    """
+
+    if aprx_path not in _APRX_CACHE:
+        aprx = arcpy.mp.ArcGISProject(aprx_path)
+        # get the list of maps in the project, and select the 1st one
+        _APRX_CACHE[aprx_path] = aprx, aprx.listMaps()[0]
+    return _APRX_CACHE[aprx_path]
+
+
+def add_layers_to_project(layer_names: list[str]):
     """
-    Function to add an incoming layer to the project and saves the project
-    :param layer_name: the name of the layer to add to the project
+    Function to add the incoming layers to the project, the project is opened and saved once for all the layers
+    :param layer_names: the names of the layers to add to the project
     :return: null
     """
 
-    print(f"Adding {layer_name} to project.")
-    print("Please wait...")
+    print(f"Adding {layer_names} to project.\nPlease wait...")
     try:
-        proj_path = r"D:\jilli\Documents\ACC-RRCC\Spring_2025\GIS3005_GIS_Apps\labs\lab1\WestNileOutbreak"
-        aprx = arcpy.mp.ArcGISProject(rf"{proj_path}\WestNileOutbreak.aprx")
-
-        # get the list of maps in the project, and select the 1st one
-        map_doc = aprx.listMaps()[0]
+        aprx, map_doc = get_project(APRX_PATH)
 
-        # add the layer to the project
-        map_doc.addDataFromPath(rf"{proj_path}\WestNileOutbreak.gdb\{layer_name}")
+        # add the layers to the project
+        for layer_name in layer_names:
+            map_doc.addDataFromPath(os.path.join(GDB_PATH, layer_name))
+            print(f"'{layer_name}' added to project map.")
 
-        # save the project
+        # save the project once all the layers are added
         aprx.save()
-        print(f"'{layer_name}' added to project map.")
 
     except OSError as e:
-        print(f"Could not add layer '{layer_name}' to project")
-        print(f"Error encountered: {e}")
-        print("Try closing ArcPro and try again.")
+        print(f"Could not add layers {layer_names} to project\n"
+              f"Error encountered: {e}\n"
+              "Try closing ArcPro and try again.")
 
 
-def query_by_attribute(layer_name: str, query: str, selection: str="NEW_SELECTION"):
+def query_by_attribute(layer_name: str, query: str):
     """
-    Function to run a query by attribute
+    Function to count the features that match a query by attribute, the features are counted with a search cursor
+    so no selection layer has to be created
     :param layer_name: the layer to query
     :param query: the where clause of the query to use against the layer
-    :param selection: the selection type to use in query, default is new selection
     :return count_result: the number that was found from the query
     """
 
-    print(f"Querying '{layer_name}' with query '{query}' as '{selection}'")
-    query_result = arcpy.management.SelectLayerByAttribute(in_layer_or_view=layer_name,
-                                                           selection_type=selection,
-                                                           where_clause=query)
-    count_result = arcpy.management.GetCount(query_result)
+    print(f"Querying '{layer_name}' with query '{query}'")
+    with arcpy.da.SearchCursor(layer_name, ['OID@'], where_clause=query) as cursor:
+        count_result = sum(1 for _ in cursor)
     return count_result
 
 
@@ -158,11 +265,11 @@ def delete_existing_layer(layer_name: str):
     :return: null
     """
 
-    # check if the layer exists, delete it if it does
-    if arcpy.Exists(layer_name):
-        print(f"'{layer_name}' already exists - deleting existing layer")
-        arcpy.Delete_management(layer_name)
-    else:
+    # try to delete the layer, the delete fails when it does not exist which saves a separate existence check
+    try:
+        arcpy.management.Delete(layer_name)
+        print(f"'{layer_name}' already existed - deleted existing layer")
+    except arcgisscripting.ExecuteError:
         print(f"'{layer_name}' does not exist yet")
 
 
@@ -204,13 +311,11 @@ def get_units_for_buffer():
     """
 
     # Define a list of acceptable units
-    valid_units = ["Feet", "Yards", "Miles", "Meters", "Kilometers"]
+    valid_units = VALID_UNITS
     default_unit = "Feet"
 
     # Print the list of units to the user for unit selection
-    print("Select a unit for buffering:")
-    for i, unit in enumerate(valid_units, 1):
-        print(f"{i}. {unit}")
+    print(f"Select a unit for buffering:\n{UNIT_MENU}")
 
     # Get user input and validate, continue loop until valid selection is made
     while True:
@@ -236,22 +341,16 @@ def get_units_for_buffer():
 
 def is_valid_layer_name(layer_name: str):
     """
-    Function to check for invalid characters, spaces, starting number or starting hyphen
+    Function to check for spaces, starting hyphen, starting number or characters other than letters, numbers and
+    underscores
     :param layer_name: the layer name that was entered
     :return: true if it passes
     """
 
-    # Define invalid characters pattern (special characters)
-    invalid_chars = r'[!@#$%^&*()+=;:\'",.<>/\?\\|\[\]{}`~]'
-
     # Check if the name contains spaces
     if ' ' in layer_name:
         raise ValueError("Layer name cannot contain spaces.")
 
-    # Check if the name contains invalid characters
-    if re.search(invalid_chars, layer_name):
-        raise ValueError("Layer name contains invalid characters.")
-
     # Check if the name starts with a hyphen
     if layer_name[0] == '-':
         raise ValueError("Layer name cannot start with a hyphen.")
@@ -260,6 +359,10 @@ def is_valid_layer_name(layer_name: str):
     if layer_name[0].isdigit():
         raise ValueError("Layer name cannot start with a number.")
 
+    # Check if the name contains invalid characters, a single set lookup over the whole name
+    if not ALLOWED_CHARS.issuperset(layer_name):
+        raise ValueError("Layer name contains invalid characters.")
+
     # Return true if everything passes successfully
     return True
 
@@ -304,9 +407,12 @@ def ask_to_continue(prompt: str="Would you like to continue?"):
     # Define a list of acceptable answers
     valid_answers = ["Yes", "No"]
 
-    print(f"{prompt}")
-    for i, answer in enumerate(valid_answers, 1):
-        print(f"{i}. {answer}")
+    # answer yes without asking when --yes was passed
+    if ARGS.yes:
+        print(f"{prompt} {valid_answers[0]}")
+        return valid_answers[0]
+
+    print(f"{prompt}\n{YES_NO_MENU}")
 
     # Get user input and validate, continue loop until valid selection is made
     while True:
@@ -328,21 +434,18 @@ def ask_to_continue(prompt: str="Would you like to continue?"):
 
 
 def main():
+    global ARGS
+
     try:
+        ARGS = parse_args()
         setup()
         print()
 
         # layers that exist in gdb which will be buffered
         layers_to_buffer = ["Lakes_and_Reservoirs", "Wetlands", "Mosquito_Larval_Sites", "OSMP_Properties"]
-        # list of buffered layers that will be used for intersect function
-        buffer_layer_list = []
-        # buffer the layers that need to be buffered
-        for layer in layers_to_buffer:
-            buffered_layer = buffer(layer)
-            # add the name to the list of buffered layers
-            buffer_layer_list.append(buffered_layer)
-            # print a new line for readability in console
-            print()
+        # buffer the layers that need to be buffered, the list of buffered layers will be used for intersect function
+        buffer_layer_list = buffer_layers(layers_to_buffer)
+        print()
 
         # intersect the buffered layers
         intersect_layer = intersect(buffer_layer_list)
@@ -356,13 +459,12 @@ def main():
         # inform the user the number of address that were found
         qry = "Join_Count = 1"
         qry_result = query_by_attribute(layer_name=spatial_layer, query=qry)
-        print(f"There are {qry_result} addresses found which fall within concerned mosquito areas.")
-        print()
+        print(f"There are {qry_result} addresses found which fall within concerned mosquito areas.\n")
 
         # add the spatial join layer to the arcgis project
         answer = ask_to_continue(prompt=f"Would you like to add '{spatial_layer}' to the project map?")
         if answer == "Yes":
-            add_layer_to_project(spatial_layer)
+            add_layers_to_project([spatial_layer])
         else:
             print(f"Will not add '{spatial_layer}' to the map")
         print()
@@ -371,8 +473,8 @@ def main():
         print("Script complete. Ending program.")
 
     except arcgisscripting.ExecuteError as e:
-        print(f"Error encountered: {e}")
-        print(f"Cannot run program. Try closing ArcGIS Pro before continuing.")
+        print(f"Error encountered: {e}\n"
+              "Cannot run program. Try closing ArcGIS Pro before continuing.")
 
 
 # Press the green button in the gutter to run the script.
@@ -1,5 +1,4 @@
 import os
-from turtle import config_dict
 
 import arcpy
 import re
@@ -7,6 +6,10 @@ import yaml
 import arcgisscripting
 from etl.GSheetsEtl import GSheetsEtl
 
+# config dictionary loaded from the yaml file, filled in by main
+config_dict: dict = {}
+
+
 def etl():
     """
     Start the ETL process which gets the addresses to opt out
@@ -1,7 +1,6 @@
 import datetime
 import logging
 import os
-from turtle import config_dict
 
 import arcpy
 import re
@@ -9,6 +8,10 @@ import yaml
 import arcgisscripting
 from etl.GSheetsEtl import GSheetsEtl
 
+# config dictionary loaded from the yaml file, filled in by main
+config_dict: dict = {}
+
+
 def etl():
     """
     Start the ETL process which gets the addresses to opt out